@@ -142,3 +142,17 @@ with open("data/doaj_issns.json", "r") as fh:
 with open("data/doaj_titles.json", "r") as fh:
     doaj_titles = [(title.encode("utf-8"), license, start_year) for (title, license, start_year) in json.load(fh)]
 
+
+def normalize_doaj_title(title_encoded):
+    return title_encoded.strip().lower()
+
+# index the doaj rows once here so lookups don't have to scan the whole list.
+# each key keeps its (license, start_year) rows in file order, so the first
+# usable row is the same one the old linear scan would have found.
+doaj_issns_index = {}
+for (row_issn_no_hypen, row_license, doaj_start_year) in doaj_issns:
+    doaj_issns_index.setdefault(row_issn_no_hypen, []).append((row_license, doaj_start_year))
+
+doaj_titles_index = {}
+for (row_journal_name, row_license, doaj_start_year) in doaj_titles:
+    doaj_titles_index.setdefault(normalize_doaj_title(row_journal_name), []).append((row_license, doaj_start_year))
@@ -41,12 +41,16 @@ def create_email(address, subject, template_name, context, attachment_filenames)
 
 def add_results_attachment(email, filename=None):
     my_attachment = Attachment()
-    attachment_type = filename.split(".")[1]
-    if attachment_type=="csv":
-        my_attachment.type = "application/{}".format(attachment_type)
+    attachment_type = os.path.basename(filename).split(".")[1]
+    if filename.endswith(".gz"):
+        my_attachment.type = "application/gzip"
+        my_attachment.filename = "results.{}.gz".format(attachment_type)
     else:
-        my_attachment.type = "application/text"
-    my_attachment.filename = "results.{}".format(attachment_type)
+        if attachment_type=="csv":
+            my_attachment.type = "application/{}".format(attachment_type)
+        else:
+            my_attachment.type = "application/text"
+        my_attachment.filename = "results.{}".format(attachment_type)
     my_attachment.disposition = "attachment"
     my_attachment.content_id = "results file"
     with open(filename, 'rb') as f:
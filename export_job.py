@@ -0,0 +1,141 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import gzip
+import datetime
+from time import time
+import shortuuid
+import unicodecsv
+from sqlalchemy.dialects.postgresql import JSONB
+
+from app import db
+from app import logger
+from emailer import create_email
+from emailer import send
+from util import clean_doi
+from util import safe_commit
+from util import elapsed
+
+
+# create table export_job (id text primary key, email text, dois jsonb, status text, error text,
+#     num_dois integer, num_rows integer, created timestamp, started timestamp, finished timestamp)
+
+EXPORT_DIR = os.getenv("EXPORT_DIR", "data/exports")
+
+
+def enqueue_export_job(email, dirty_dois):
+    clean_dois = [clean_doi(dirty_doi, return_none_if_error=True) for dirty_doi in dirty_dois]
+    clean_dois = [doi for doi in clean_dois if doi]
+
+    my_job = ExportJob(email=email, dois=clean_dois)
+    db.session.add(my_job)
+    safe_commit(db)
+    return my_job
+
+
+def display_date(value):
+    if not value:
+        return None
+    try:
+        return value.isoformat()
+    except AttributeError:
+        return value
+
+
+class ExportJob(db.Model):
+    id = db.Column(db.Text, primary_key=True)
+    email = db.Column(db.Text)
+    dois = db.Column(JSONB)
+    status = db.Column(db.Text)
+    error = db.Column(db.Text)
+    num_dois = db.Column(db.Integer)
+    num_rows = db.Column(db.Integer)
+    created = db.Column(db.DateTime)
+    started = db.Column(db.DateTime)
+    finished = db.Column(db.DateTime)
+
+    def __init__(self, **kwargs):
+        self.id = shortuuid.uuid()[0:20]
+        self.status = "queued"
+        self.error = ""
+        self.created = datetime.datetime.utcnow().isoformat()
+        super(ExportJob, self).__init__(**kwargs)
+        self.num_dois = len(self.dois or [])
+
+    @property
+    def jsonl_filename(self):
+        return os.path.join(EXPORT_DIR, u"{}.jsonl.gz".format(self.id))
+
+    @property
+    def csv_filename(self):
+        return os.path.join(EXPORT_DIR, u"{}.csv.gz".format(self.id))
+
+    def run(self):
+        from pub import get_stored_responses_from_dois
+        from pub import csv_dict_from_response_dict
+        from pub import csv_fieldnames
+
+        start_time = time()
+        self.status = "running"
+        self.started = datetime.datetime.utcnow()
+        self.error = ""
+        self.num_rows = 0
+        # so the status endpoint shows it's running while we write the files
+        safe_commit(db)
+
+        if not os.path.isdir(EXPORT_DIR):
+            os.makedirs(EXPORT_DIR)
+
+        try:
+            # write rows as they come back from the db, so memory doesn't grow with the number of dois
+            with gzip.open(self.jsonl_filename, "wb") as jsonl_file, gzip.open(self.csv_filename, "wb") as csv_file:
+                writer = unicodecsv.DictWriter(csv_file, fieldnames=csv_fieldnames(), dialect='excel')
+                writer.writeheader()
+                for (doi, is_in_db, response_jsonb) in get_stored_responses_from_dois(self.dois or []):
+                    if not response_jsonb:
+                        continue
+                    jsonl_file.write(json.dumps(response_jsonb, sort_keys=True))
+                    jsonl_file.write("\n")
+                    writer.writerow(csv_dict_from_response_dict(response_jsonb))
+                    self.num_rows += 1
+        except Exception:
+            logger.exception(u"exception writing export files for {}".format(self))
+            self.status = "error"
+            self.error = u"Exception writing export files"
+            return
+
+        logger.info(u"wrote {} rows for {} in {} seconds".format(self.num_rows, self, elapsed(start_time)))
+
+        # only send once both files are completely written
+        try:
+            email = create_email(self.email,
+                         "Your Unpaywall results",
+                         "simple_query_tool",
+                         {"profile": {}},
+                         [self.csv_filename, self.jsonl_filename])
+            send(email, for_real=True)
+        except Exception:
+            logger.exception(u"exception emailing export for {}".format(self))
+            self.status = "error"
+            self.error = u"Exception sending email"
+            return
+
+        self.status = "emailed"
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "email": self.email,
+            "status": self.status,
+            "error": self.error or None,
+            "num_dois": self.num_dois,
+            "num_rows": self.num_rows,
+            "created": display_date(self.created),
+            "started": display_date(self.started),
+            "finished": display_date(self.finished)
+        }
+
+    def __repr__(self):
+        return u"<ExportJob ( {} ) {} {}>".format(self.id, self.email, self.status)
@@ -0,0 +1,217 @@
+import os
+import json
+import urlparse
+from collections import deque
+from email.utils import parsedate_tz
+from email.utils import mktime_tz
+from threading import Lock
+from time import time
+from time import sleep
+
+import requests
+
+from app import logger
+
+
+# steady-state requests per second we send to any one host, per process
+HOST_REQUESTS_PER_SECOND = float(os.getenv("HOST_REQUESTS_PER_SECOND", 2.0))
+HOST_BURST = int(os.getenv("HOST_BURST", 5))
+
+# never slow a host down further than this
+HOST_MIN_REQUESTS_PER_SECOND = 0.05
+
+# cap on Retry-After and on our own backoff
+HOST_MAX_BACKOFF_SECONDS = int(os.getenv("HOST_MAX_BACKOFF_SECONDS", 60*10))
+
+# rather than block a worker longer than this, give up on the request
+HOST_MAX_WAIT_SECONDS = int(os.getenv("HOST_MAX_WAIT_SECONDS", 60))
+
+# look at this many recent responses to decide if a host is struggling
+HOST_ERROR_WINDOW = 20
+HOST_ERROR_RATE_THRESHOLD = 0.5
+
+HOST_ERROR_STATUS_CODES = [429, 500, 502, 503, 504]
+
+# hosts that don't get the default bucket: host -> [requests per second, burst], or None for
+# no rate limit.  the doi resolvers only redirect (to the publisher, which gets its own bucket),
+# and the apis we call for every pub are built for that traffic.
+# add to or change these with eg HOST_RATE_OVERRIDES='{"api.example.org": [5, 10]}'
+HOST_RATE_OVERRIDES = {
+    "doi.org": None,
+    "dx.doi.org": None,
+    "www.ebi.ac.uk": [20, 40],
+    "api.crossref.org": [20, 40],
+    "api.unpaywall.org": None
+}
+HOST_RATE_OVERRIDES.update(json.loads(os.getenv("HOST_RATE_OVERRIDES", "{}")))
+
+
+class HostBackoffException(requests.exceptions.RequestException):
+    pass
+
+
+def host_for_url(url):
+    try:
+        return urlparse.urlparse(url).netloc.lower()
+    except (AttributeError, ValueError):
+        return u""
+
+
+def parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(0, int(value))
+    except ValueError:
+        pass
+    parsed_date = parsedate_tz(value)
+    if parsed_date:
+        return max(0, mktime_tz(parsed_date) - time())
+    return None
+
+
+class HostState(object):
+    # base_rate None means this host isn't rate limited, only paused when it sends Retry-After
+    def __init__(self, base_rate, burst):
+        self.is_limited = base_rate is not None
+        self.base_rate = float(base_rate or 0)
+        self.rate = float(base_rate or 0)
+        self.burst = burst
+        self.tokens = float(burst or 0)
+        self.last_refill = time()
+        self.blocked_until = 0
+        self.consecutive_errors = 0
+        self.recent_outcomes = deque(maxlen=HOST_ERROR_WINDOW)
+        self.num_requests = 0
+        self.num_errors = 0
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def seconds_until_ready(self, now):
+        if not self.is_limited:
+            return max(0, self.blocked_until - now)
+        self.refill(now)
+        wait = 0
+        if self.tokens < 1:
+            wait = (1 - self.tokens) / self.rate
+        return max(wait, self.blocked_until - now)
+
+    @property
+    def error_rate(self):
+        if not self.recent_outcomes:
+            return 0
+        return len([outcome for outcome in self.recent_outcomes if not outcome]) / float(len(self.recent_outcomes))
+
+    def to_dict(self):
+        return {
+            "rate": round(self.rate, 3) if self.is_limited else None,
+            "blocked_for": max(0, round(self.blocked_until - time(), 1)),
+            "error_rate": round(self.error_rate, 3),
+            "num_requests": self.num_requests,
+            "num_errors": self.num_errors
+        }
+
+
+class HostScheduler(object):
+    """
+    Token bucket per host, in front of http_get.  Honors Retry-After, and backs off
+    a host (halving its rate, then pausing it) when most of its recent responses are
+    errors, recovering slowly as it succeeds again.
+    """
+    def __init__(self, requests_per_second=HOST_REQUESTS_PER_SECOND, burst=HOST_BURST, max_wait_seconds=HOST_MAX_WAIT_SECONDS):
+        self.requests_per_second = requests_per_second
+        self.burst = burst
+        self.max_wait_seconds = max_wait_seconds
+        self.hosts = {}
+        self.lock = Lock()
+
+    def host_state(self, host):
+        # call with self.lock held
+        if host not in self.hosts:
+            if host in HOST_RATE_OVERRIDES:
+                rate_setting = HOST_RATE_OVERRIDES[host]
+                if rate_setting:
+                    self.hosts[host] = HostState(rate_setting[0], rate_setting[1])
+                else:
+                    self.hosts[host] = HostState(None, None)
+            else:
+                self.hosts[host] = HostState(self.requests_per_second, self.burst)
+        return self.hosts[host]
+
+    def is_rate_limited(self, host):
+        return host not in HOST_RATE_OVERRIDES or HOST_RATE_OVERRIDES[host] is not None
+
+    def seconds_until_ready(self, host):
+        with self.lock:
+            if host not in self.hosts:
+                return 0
+            return self.hosts[host].seconds_until_ready(time())
+
+    def acquire(self, url):
+        host = host_for_url(url)
+        while True:
+            with self.lock:
+                state = self.host_state(host)
+                now = time()
+                wait = state.seconds_until_ready(now)
+                if wait <= 0:
+                    if state.is_limited:
+                        state.tokens -= 1
+                    state.num_requests += 1
+                    return
+            if wait > self.max_wait_seconds:
+                raise HostBackoffException(u"backing off {} for another {} seconds".format(host, round(wait)))
+            sleep(wait)
+
+    def record_response(self, url, status_code, headers=None):
+        is_error = status_code in HOST_ERROR_STATUS_CODES
+        retry_after = None
+        if headers and status_code in [429, 503]:
+            retry_after = parse_retry_after(headers.get("Retry-After", None))
+        self.record_outcome(url, is_error, retry_after)
+
+    def record_exception(self, url):
+        self.record_outcome(url, True)
+
+    def record_outcome(self, url, is_error, retry_after=None):
+        host = host_for_url(url)
+        with self.lock:
+            state = self.host_state(host)
+            now = time()
+            state.recent_outcomes.append(not is_error)
+
+            if retry_after is not None:
+                state.blocked_until = max(state.blocked_until, now + min(retry_after, HOST_MAX_BACKOFF_SECONDS))
+                logger.info(u"{} asked us to retry after {} seconds".format(host, retry_after))
+
+            if not state.is_limited:
+                # nothing to slow down, only the Retry-After pause above
+                if is_error:
+                    state.num_errors += 1
+                return
+
+            if not is_error:
+                state.consecutive_errors = 0
+                # additive increase back toward the normal rate
+                state.rate = min(state.base_rate, state.rate + state.base_rate * 0.05)
+                return
+
+            state.num_errors += 1
+            state.consecutive_errors += 1
+            if len(state.recent_outcomes) >= 5 and state.error_rate >= HOST_ERROR_RATE_THRESHOLD:
+                # multiplicative decrease, plus a pause that grows while errors continue
+                state.rate = max(HOST_MIN_REQUESTS_PER_SECOND, state.rate / 2)
+                backoff_seconds = min(HOST_MAX_BACKOFF_SECONDS, 2 ** state.consecutive_errors)
+                state.blocked_until = max(state.blocked_until, now + backoff_seconds)
+                logger.info(u"backing off {}: error rate {}, now {} requests/second, paused {} seconds".format(
+                    host, round(state.error_rate, 2), round(state.rate, 3), backoff_seconds))
+
+    @property
+    def stats(self):
+        with self.lock:
+            return dict((host, state.to_dict()) for (host, state) in self.hosts.iteritems())
+
+
+host_scheduler = HostScheduler()
@@ -15,6 +15,11 @@ from requests.adapters import HTTPAdapter
 from time import time
 from time import sleep
 import inspect
+import threading
+import tempfile
+import zlib
+from functools import partial
+from requests.structures import CaseInsensitiveDict
 
 from app import logger
 from util import clean_doi
@@ -24,6 +29,8 @@ from util import elapsed
 from util import NoDoiException
 from util import DelayedAdapter
 from util import is_same_publisher
+from host_scheduler import host_scheduler
+from host_scheduler import HostBackoffException
 
 MAX_PAYLOAD_SIZE_BYTES = 1000*1000*10 # 10mb
 
@@ -94,6 +101,31 @@ class RequestWithFileDownload(object):
         # return self.content_read
 
 
+    # just the start of the body, for deciding if it's a pdf without downloading all of it.
+    # whatever is read here is kept, and content_big carries on from where it stopped.
+    def content_prefix(self, num_bytes=1024):
+        if hasattr(self, "content_read"):
+            return self.content_read[0:num_bytes]
+
+        if not self.raw:
+            return self.content[0:num_bytes]
+
+        if not hasattr(self, "content_prefix_chunks"):
+            self.content_prefix_chunks = []
+            self.content_prefix_length = 0
+            self.content_chunk_iterator = self.iter_content(64*1024)
+
+        while self.content_prefix_length < num_bytes:
+            try:
+                chunk = next(self.content_chunk_iterator)
+            except StopIteration:
+                break
+            self.content_prefix_chunks.append(chunk)
+            self.content_prefix_length += len(chunk)
+
+        return b"".join(self.content_prefix_chunks)[0:num_bytes]
+
+
     def content_big(self):
         if hasattr(self, "content_read"):
             return self.content_read
@@ -104,19 +136,215 @@ class RequestWithFileDownload(object):
 
         megabyte = 1024*1024
         maxsize = 25 * megabyte
-        self.content_read = b""
-        for chunk in self.iter_content(megabyte):
-            self.content_read += chunk
-            if len(self.content_read) > maxsize:
+
+        # collect the chunks and join once at the end; adding to a string each time is quadratic
+        if hasattr(self, "content_prefix_chunks"):
+            chunks = list(self.content_prefix_chunks)
+            size = self.content_prefix_length
+            chunk_iterator = self.content_chunk_iterator
+        else:
+            chunks = []
+            size = 0
+            chunk_iterator = self.iter_content(megabyte)
+
+        is_complete = True
+        for chunk in chunk_iterator:
+            chunks.append(chunk)
+            size += len(chunk)
+            if size > maxsize:
                 logger.info(u"webpage is too big at {}, only getting first {} bytes".format(self.request.url, maxsize))
                 self.close()
-                return self.content_read
+                is_complete = False
+                break
+
+        self.content_read = b"".join(chunks)
+        if is_complete:
+            self.content_fully_read()
         return self.content_read
 
 
+    # http_get sets on_content_fully_read for streamed responses, so their body gets
+    # cached once a caller has read all of it
+    def content_fully_read(self):
+        callback = getattr(self, "on_content_fully_read", None)
+        if callback:
+            self.on_content_fully_read = None
+            callback(self)
+
+
+# from http://jakeaustwick.me/extending-the-requests-response-class/
+# only needs doing once per process
+for method_name, method in inspect.getmembers(RequestWithFileDownload, inspect.ismethod):
+    setattr(requests.models.Response, method_name, method.im_func)
+
+
+# how many hosts each session keeps pools for, and how many connections per host
+HTTP_POOL_NUM_HOSTS = int(os.getenv("HTTP_POOL_NUM_HOSTS", 100))
+HTTP_POOL_MAXSIZE_PER_HOST = int(os.getenv("HTTP_POOL_MAXSIZE_PER_HOST", 4))
+
+# sessions are long-lived so we keep keep-alive connections and tls sessions,
+# but they aren't thread-safe, so each thread gets its own
+thread_local_sessions = threading.local()
+
+def build_pooled_session(ask_slowly):
+    if ask_slowly:
+        retries = Retry(total=1,
+                        backoff_factor=0.1,
+                        status_forcelist=[500, 502, 503, 504])
+    else:
+        retries = Retry(total=0,
+                        backoff_factor=0.1,
+                        status_forcelist=[500, 502, 503, 504])
+
+    requests_session = requests.Session()
+    for prefix in ['http://', 'https://']:
+        requests_session.mount(prefix, DelayedAdapter(max_retries=retries,
+                                                      pool_connections=HTTP_POOL_NUM_HOSTS,
+                                                      pool_maxsize=HTTP_POOL_MAXSIZE_PER_HOST))
+    return requests_session
+
+def get_pooled_session(ask_slowly=False):
+    if not hasattr(thread_local_sessions, "sessions"):
+        thread_local_sessions.sessions = {}
+    if ask_slowly not in thread_local_sessions.sessions:
+        thread_local_sessions.sessions[ask_slowly] = build_pooled_session(ask_slowly)
+
+    requests_session = thread_local_sessions.sessions[ask_slowly]
+    # start clean every time, like we did when we made a new session for every request
+    requests_session.cookies.clear()
+    return requests_session
+
+
+# on-disk response cache for http_get.  turn it on for everything with
+# HTTP_CACHE_ENABLED=True, or per call with cache_enabled=True
+HTTP_CACHE_ENABLED = os.getenv("HTTP_CACHE_ENABLED", "False") == "True"
+HTTP_CACHE_DIR = os.getenv("HTTP_CACHE_DIR", "data/http_cache")
+HTTP_CACHE_MAX_BODY_BYTES = 25 * 1000 * 1000
+
+# statuses not listed here aren't cached.  5xx and 429 are worth retrying soon.
+HTTP_CACHE_TTL_SECONDS_BY_STATUS = {
+    200: 60*60*24*30,
+    401: 60*60*24*7,
+    403: 60*60*24*7,
+    404: 60*60*24*7,
+    410: 60*60*24*30
+}
+
+# None if the url or headers can't be serialized (eg byte strings that aren't utf-8), so they aren't cached
+def http_cache_key(url, headers):
+    try:
+        key_string = json.dumps([url, sorted((headers or {}).items())])
+    except (TypeError, ValueError, UnicodeError):
+        return None
+    return hashlib.sha1(key_string.encode("utf-8")).hexdigest()
+
+def http_cache_path(kind, hash_string, extension):
+    # shard so one directory doesn't get millions of files
+    return os.path.join(HTTP_CACHE_DIR, kind, hash_string[0:2], u"{}.{}".format(hash_string, extension))
+
+def write_http_cache_file(path, data):
+    cache_dir = os.path.dirname(path)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    # write then rename, so a concurrent reader never sees half a file
+    (fd, temp_path) = tempfile.mkstemp(dir=cache_dir)
+    with os.fdopen(fd, "wb") as fh:
+        fh.write(data)
+    os.rename(temp_path, path)
+
+def get_http_cache_entry(url, headers):
+    key = http_cache_key(url, headers)
+    if not key:
+        return None, None
+    try:
+        with open(http_cache_path("meta", key, "json"), "rb") as fh:
+            meta = json.load(fh)
+        # bodies are stored by content hash, so the same pdf at many urls is stored once
+        with open(http_cache_path("body", meta["body_hash"], "z"), "rb") as fh:
+            body = zlib.decompress(fh.read())
+    except (IOError, OSError, ValueError, KeyError, zlib.error):
+        return None, None
+    return meta, body
+
+def http_cache_entry_is_fresh(meta):
+    ttl = HTTP_CACHE_TTL_SECONDS_BY_STATUS.get(meta["status_code"], 0)
+    return time() - meta["stored"] < ttl
+
+def store_http_cache_entry(url, headers, meta, body):
+    key = http_cache_key(url, headers)
+    if not key:
+        return
+    try:
+        # serialize first, so headers we can't store don't leave an orphaned body behind
+        meta_string = json.dumps(meta)
+    except (TypeError, ValueError, UnicodeError):
+        logger.info(u"not caching a response whose headers can't be serialized")
+        return
+    try:
+        write_http_cache_file(http_cache_path("body", meta["body_hash"], "z"), zlib.compress(body))
+        write_http_cache_file(http_cache_path("meta", key, "json"), meta_string)
+    except (IOError, OSError):
+        logger.exception(u"couldn't write http cache entry for {}".format(url))
+
+def save_response_to_http_cache(url, headers, r):
+    if r.status_code not in HTTP_CACHE_TTL_SECONDS_BY_STATUS:
+        return
+    if is_response_too_large(r):
+        return
+
+    body = r.content_big()
+    if len(body) > HTTP_CACHE_MAX_BODY_BYTES:
+        return
+
+    meta = {
+        "url": r.url,
+        "status_code": r.status_code,
+        "headers": dict(r.headers),
+        "encoding": r.encoding,
+        "stored": time(),
+        "body_hash": hashlib.sha1(body).hexdigest()
+    }
+    store_http_cache_entry(url, headers, meta, body)
+
+def build_response_from_http_cache(meta, body):
+    r = requests.models.Response()
+    r.status_code = meta["status_code"]
+    r.headers = CaseInsensitiveDict(meta["headers"])
+    r.url = meta["url"]
+    r.encoding = meta["encoding"]
+    r.request = requests.Request("GET", meta["url"]).prepare()
+    r._content = body
+    r._content_consumed = True
+    return r
+
+def conditional_request_headers(meta):
+    cached_headers = CaseInsensitiveDict(meta["headers"])
+    conditional_headers = {}
+    if cached_headers.get("ETag", None):
+        conditional_headers["If-None-Match"] = cached_headers["ETag"]
+    if cached_headers.get("Last-Modified", None):
+        conditional_headers["If-Modified-Since"] = cached_headers["Last-Modified"]
+    return conditional_headers
+
+
 def get_session_id():
     return None
 
+class RedirectThrottle(object):
+    # a response hook.  requests follows redirects itself, so wait for the next host's turn here:
+    # eg doi.org isn't rate limited, but the publisher it sends us to is.
+    # remembers the last url let through, so an exception is charged to the host we were talking to.
+    def __init__(self):
+        self.last_url = None
+
+    def acquire(self, url):
+        host_scheduler.acquire(url)
+        self.last_url = url
+
+    def __call__(self, r, *args, **kwargs):
+        if r.is_redirect:
+            self.acquire(urlparse.urljoin(r.url, r.headers["location"]))
+
 def call_requests_get(url,
                       headers={},
                       read_timeout=60,
@@ -124,23 +352,15 @@ def call_requests_get(url,
                       stream=False,
                       publisher=None,
                       session_id=None,
-                      ask_slowly=False):
+                      ask_slowly=False,
+                      throttle=None):
 
+    if not throttle:
+        throttle = RedirectThrottle()
     following_redirects = True
     num_redirects = 0
     while following_redirects:
-        requests_session = requests.Session()
-
-        if ask_slowly:
-            retries = Retry(total=1,
-                            backoff_factor=0.1,
-                            status_forcelist=[500, 502, 503, 504])
-        else:
-            retries = Retry(total=0,
-                            backoff_factor=0.1,
-                            status_forcelist=[500, 502, 503, 504])
-        requests_session.mount('http://', DelayedAdapter(max_retries=retries))
-        requests_session.mount('https://', DelayedAdapter(max_retries=retries))
+        requests_session = get_pooled_session(ask_slowly)
 
         if u"citeseerx.ist.psu.edu/" in url:
             url = url.replace("http://", "https://")
@@ -156,13 +376,9 @@ def call_requests_get(url,
                     stream=stream,
                     proxies=proxies,
                     allow_redirects=True,
+                    hooks={"response": throttle},
                     verify=False)
 
-
-        # from http://jakeaustwick.me/extending-the-requests-response-class/
-        for method_name, method in inspect.getmembers(RequestWithFileDownload, inspect.ismethod):
-            setattr(requests.models.Response, method_name, method.im_func)
-
         if r and not r.encoding:
             r.encoding = "utf-8"
 
@@ -174,6 +390,7 @@ def call_requests_get(url,
             if redirect_url:
                 following_redirects = True
                 url = redirect_url
+                throttle.acquire(url)
 
     return r
 
@@ -194,6 +411,19 @@ def http_get(url,
     # reset
     os.environ["HTTP_PROXY"] = ""
 
+    use_cache = cache_enabled or HTTP_CACHE_ENABLED
+    cached_meta = None
+    request_headers = headers
+    if use_cache:
+        (cached_meta, cached_body) = get_http_cache_entry(url, headers)
+        if cached_meta:
+            if http_cache_entry_is_fresh(cached_meta):
+                logger.info(u"CACHED GET on {}".format(url))
+                return build_response_from_http_cache(cached_meta, cached_body)
+            # stale, so ask the server if it has changed
+            request_headers = dict(headers)
+            request_headers.update(conditional_request_headers(cached_meta))
+
     try:
         logger.info(u"LIVE GET on {}".format(url))
     except UnicodeDecodeError:
@@ -206,19 +436,29 @@ def http_get(url,
     tries = 0
     r = None
     while not success:
+        throttle = RedirectThrottle()
         try:
+            # waits for this host's turn, or raises HostBackoffException if that's too long
+            throttle.acquire(url)
             r = call_requests_get(url,
-                                  headers=headers,
+                                  headers=request_headers,
                                   read_timeout=read_timeout,
                                   connect_timeout=connect_timeout,
                                   stream=stream,
                                   publisher=publisher,
                                   session_id=session_id,
-                                  ask_slowly=ask_slowly)
+                                  ask_slowly=ask_slowly,
+                                  throttle=throttle)
+            # charged to the host that answered, after any redirects, not the one we asked
+            host_scheduler.record_response(r.url, r.status_code, r.headers)
             success = True
         except (KeyboardInterrupt, SystemError, SystemExit):
             raise
+        except HostBackoffException as e:
+            logger.info(u"in http_get, not trying {}: {}".format(url, e))
+            raise
         except Exception as e:
+            host_scheduler.record_exception(throttle.last_url or url)
             # don't make this an exception log for now
             logger.info(u"exception in call_requests_get")
             tries += 1
@@ -230,5 +470,17 @@ def http_get(url,
         finally:
             logger.info(u"finished http_get for {} in {} seconds".format(url, elapsed(start_time, 2)))
 
+    if use_cache and r is not None:
+        if r.status_code == 304 and cached_meta:
+            logger.info(u"not modified, using cached copy of {}".format(url))
+            cached_meta["stored"] = time()
+            store_http_cache_entry(url, headers, cached_meta, cached_body)
+            return build_response_from_http_cache(cached_meta, cached_body)
+        if stream:
+            # callers often stop reading early (eg it isn't a pdf), so cache it only once they've read it all
+            r.on_content_fully_read = partial(save_response_to_http_cache, url, headers)
+        else:
+            save_response_to_http_cache(url, headers, r)
+
     return r
 
@@ -18,6 +18,15 @@ from util import safe_commit
 from util import run_sql
 
 
+def load_options(cls):
+    # pubs defer their jsonb columns and relationships, so ask for everything a recalculate uses
+    from pub import Pub
+    from pub import pub_load_options
+    if cls is Pub:
+        return pub_load_options("full_recalculate")
+    return [orm.undefer('*')]
+
+
 def update_fn(cls, method, obj_id_list, shortcut_data=None, index=1):
 
     # we are in a fork!  dispose of our engine.
@@ -29,7 +38,7 @@ def update_fn(cls, method, obj_id_list, shortcut_data=None, index=1):
 
     # logger(u"obj_id_list: {}".format(obj_id_list))
 
-    q = db.session.query(cls).options(orm.undefer('*')).filter(cls.id.in_(obj_id_list))
+    q = db.session.query(cls).options(*load_options(cls)).filter(cls.id.in_(obj_id_list))
     obj_rows = q.all()
     num_obj_rows = len(obj_rows)
 
@@ -45,7 +54,7 @@ def update_fn(cls, method, obj_id_list, shortcut_data=None, index=1):
         safe_commit(db)
         logger.info(u"done")
 
-    q = db.session.query(cls).options(orm.undefer('*')).filter(cls.id.in_(obj_id_list))
+    q = db.session.query(cls).options(*load_options(cls)).filter(cls.id.in_(obj_id_list))
     obj_rows = q.all()
     num_obj_rows = len(obj_rows)
 
@@ -0,0 +1,38 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+
+def to_unicode(text):
+    if isinstance(text, str):
+        return text.decode("utf-8", "replace")
+    return text
+
+
+class MultiMatcher(object):
+    """
+    A fixed list of substrings, normalized once.  Checking a string lowercases it once
+    and then does one `in` per word, each of which runs in C.  On py2.7 that measured
+    faster than both a pure-python Aho-Corasick and a compiled regex alternation.
+    """
+    def __init__(self, words, ignore_case=False):
+        self.ignore_case = ignore_case
+        self.words = [self.normalize(word) for word in words if word]
+
+    def normalize(self, text):
+        text = to_unicode(text)
+        if self.ignore_case:
+            text = text.lower()
+        return text
+
+    def search(self, text):
+        # returns the first word (in list order) found in text, or None
+        if not text:
+            return None
+        text = self.normalize(text)
+        for word in self.words:
+            if word in text:
+                return word
+        return None
+
+    def matches(self, text):
+        return self.search(text) is not None
@@ -9,12 +9,15 @@ import gzip
 import urllib
 
 from operator import itemgetter
-from app import doaj_issns
-from app import doaj_titles
+from app import doaj_issns_index
+from app import doaj_titles_index
+from app import normalize_doaj_title
 from app import logger
+from app import db
 from util import elapsed
 from util import remove_punctuation
 from util import safe_commit
+from multi_matcher import MultiMatcher
 
 # for things not in jdap.
 # right now the url fragments and the doi fragments are the same
@@ -43,6 +46,9 @@ preprint_doi_fragments = preprint_url_fragments
 dataset_doi_fragments = dataset_url_fragments
 open_doi_fragments = preprint_doi_fragments + dataset_doi_fragments
 
+open_url_fragment_matcher = MultiMatcher(open_url_fragments)
+open_doi_fragment_matcher = MultiMatcher(open_doi_fragments)
+
 
 def is_oa_license(license_url):
     """
@@ -82,13 +88,12 @@ def is_open_via_doaj_issn(issns, pub_year=None):
     if issns:
         for issn in issns:
             issn_no_hypen = issn.replace(u"-", "")
-            for (row_issn_no_hyphen, row_license, doaj_start_year) in doaj_issns:
-                if issn_no_hypen == row_issn_no_hyphen:
-                    if doaj_start_year and pub_year and (doaj_start_year > pub_year):
-                        pass # journal wasn't open yet!
-                    else:
-                        # logger.info(u"open: doaj issn match!")
-                        return find_normalized_license(row_license)
+            for (row_license, doaj_start_year) in doaj_issns_index.get(issn_no_hypen, []):
+                if doaj_start_year and pub_year and (doaj_start_year > pub_year):
+                    pass # journal wasn't open yet!
+                else:
+                    # logger.info(u"open: doaj issn match!")
+                    return find_normalized_license(row_license)
     return False
 
 # returns true if is in open list of issns, or doaj issns
@@ -124,13 +129,12 @@ def is_open_via_doaj_journal(all_journals, pub_year=None):
 
             journals_to_skip = ["AMM"]
             if journal_name not in journals_to_skip:
-                for (row_journal_name, row_license, doaj_start_year) in doaj_titles:
-                    if journal_name_encoded.strip().lower() == row_journal_name.strip().lower():
-                        if doaj_start_year and pub_year and (doaj_start_year > pub_year):
-                            pass # journal wasn't open yet!
-                        else:
-                            # logger.info(u"open: doaj journal name match! {}".format(journal_name))
-                            return find_normalized_license(row_license)
+                for (row_license, doaj_start_year) in doaj_titles_index.get(normalize_doaj_title(journal_name_encoded), []):
+                    if doaj_start_year and pub_year and (doaj_start_year > pub_year):
+                        pass # journal wasn't open yet!
+                    else:
+                        # logger.info(u"open: doaj journal name match! {}".format(journal_name))
+                        return find_normalized_license(row_license)
     return False
 
 def is_open_via_datacite_prefix(doi):
@@ -166,14 +170,14 @@ def is_open_via_license_urls(license_urls):
 
 def is_open_via_doi_fragment(doi):
     if doi:
-        if any(fragment in doi for fragment in open_doi_fragments):
+        if open_doi_fragment_matcher.matches(doi):
             # logger.info(u"open: doi fragment!")
             return True
     return False
 
 def is_open_via_url_fragment(url):
     if url:
-        if any(fragment in url for fragment in open_url_fragments):
+        if open_url_fragment_matcher.matches(url):
             # logger.info(u"open: url fragment!")
             return True
     return False
@@ -267,6 +271,55 @@ def save_pmcid_file():
     print "done"
 
 
+# incremental version of the above: python -c 'import oa_local; oa_local.update_pmcid_lookup();'
+# loads the new dump into a temp table and lets postgres work out the differences,
+# so only rows that changed get written
+def update_pmcid_lookup(gz_filename=None):
+    start_time = time()
+    if not gz_filename:
+        gz_filename = 'data/PMC-ids.csv.gz'
+        logger.info(u"starting ftp get")
+        urllib.urlretrieve('ftp://ftp.ncbi.nlm.nih.gov/pub/pmc/PMC-ids.csv.gz', gz_filename)
+        logger.info(u"finished ftp get")
+
+    extract_filename = "data/extract_PMC-ids.csv"
+    csvfile = gzip.open(gz_filename, 'rb')
+    my_reader = csv.DictReader(csvfile)
+    outfile = open(extract_filename, "w")
+    my_writer = csv.writer(outfile)
+    for row in my_reader:
+        # make sure it has a doi
+        if row["DOI"]:
+            my_writer.writerow([row["DOI"], row["PMCID"].lower(), row["Release Date"]])
+    outfile.close()
+    csvfile.close()
+    logger.info(u"extracted dump in {} seconds".format(elapsed(start_time)))
+
+    connection = db.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute("create temp table pmcid_lookup_new (doi text, pmcid text, release_date text) on commit drop")
+        with open(extract_filename) as extract_file:
+            cursor.copy_expert("copy pmcid_lookup_new (doi, pmcid, release_date) from stdin with csv", extract_file)
+
+        cursor.execute("""insert into pmcid_lookup (doi, pmcid, release_date)
+            select distinct on (doi) doi, pmcid, release_date from pmcid_lookup_new order by doi
+            on conflict (doi) do update set pmcid=excluded.pmcid, release_date=excluded.release_date
+            where (pmcid_lookup.pmcid, pmcid_lookup.release_date) is distinct from (excluded.pmcid, excluded.release_date)""")
+        num_upserted = cursor.rowcount
+
+        cursor.execute("""delete from pmcid_lookup
+            where not exists (select 1 from pmcid_lookup_new where pmcid_lookup_new.doi = pmcid_lookup.doi)""")
+        num_deleted = cursor.rowcount
+
+        connection.commit()
+    finally:
+        connection.close()
+
+    logger.info(u"pmcid_lookup: {} rows added or changed, {} removed, in {} seconds".format(
+        num_upserted, num_deleted, elapsed(start_time)))
+
+
 # create table pmcid_published_version_lookup (pmcid text)
 # create index pmcid_published_version_lookup_pmcid_idx on pmcid_published_version_lookup(pmcid)
 # or
@@ -1,3 +1,11 @@
+import os
+import resource
+from multiprocessing import Pipe
+from multiprocessing import Process
+from threading import BoundedSemaphore
+from threading import Lock
+from time import time
+
 from pdfminer.pdfinterp import PDFResourceManager, PDFPageInterpreter
 from pdfminer.converter import TextConverter
 from pdfminer.layout import LAParams
@@ -7,10 +15,16 @@ from app import logger
 from cStringIO import StringIO
 
 
+# pdfminer runs in a child process per pdf, so a pathological pdf can be killed
+# without taking the worker down with it
+PDF_EXTRACT_IN_CHILD_PROCESS = os.getenv("PDF_EXTRACT_IN_CHILD_PROCESS", "True") == "True"
+PDF_EXTRACT_MAX_PROCESSES = int(os.getenv("PDF_EXTRACT_MAX_PROCESSES", 2))
+PDF_EXTRACT_CPU_SECONDS = int(os.getenv("PDF_EXTRACT_CPU_SECONDS", 20))
+PDF_EXTRACT_MEMORY_BYTES = int(os.getenv("PDF_EXTRACT_MEMORY_BYTES", 300*1000*1000))
 
-def convert_pdf_to_txt(r):
-    text = None
 
+# parses up to maxpages pages, one at a time, and stops early once stop_when(text so far) is true
+def extract_text_from_pdf_bytes(pdf_bytes, maxpages=3, stop_when=None):
     rsrcmgr = PDFResourceManager()
     retstr = BytesIO()
     codec = 'utf-8'
@@ -18,27 +32,135 @@ def convert_pdf_to_txt(r):
 
     device = TextConverter(rsrcmgr, retstr, codec=codec, laparams=laparams)
 
-    if r.status_code != 200:
-        logger.info(u"error: status code {} in convert_pdf_to_txt".format(r.status_code))
-        return None
-
-    if not r.encoding:
-        r.encoding = "utf-8"
-    fp = StringIO(r.content_big())
+    fp = StringIO(pdf_bytes)
 
     interpreter = PDFPageInterpreter(rsrcmgr, device)
     password = ""
-    maxpages = 3
     caching = True
     pagenos = set()
     pages = PDFPage.get_pages(fp, pagenos, maxpages=maxpages, password=password, caching=caching, check_extractable=True)
 
     for page in pages:
         interpreter.process_page(page)
+        if stop_when and stop_when(retstr.getvalue()):
+            break
 
     text = retstr.getvalue()
 
     device.close()
     retstr.close()
+    return text
+
+
+def current_address_space_bytes():
+    try:
+        with open("/proc/self/statm") as fh:
+            return int(fh.read().split()[0]) * resource.getpagesize()
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+
+
+def extract_text_in_child(conn, pdf_bytes, maxpages, stop_when, cpu_seconds, memory_bytes):
+    # runs in the forked child.  no logging here: another thread may have held
+    # the logging lock when we forked.
+    try:
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + 1))
+        # the child starts with a copy of the parent's address space, so the budget goes on top of that
+        address_space_bytes = current_address_space_bytes()
+        if address_space_bytes:
+            limit = address_space_bytes + memory_bytes
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+        text = extract_text_from_pdf_bytes(pdf_bytes, maxpages, stop_when)
+        conn.send(("ok", text))
+    except MemoryError:
+        conn.send(("memory", None))
+    except Exception as e:
+        conn.send(("error", repr(e)))
+    finally:
+        conn.close()
+
+
+class PdfTextExtractionError(Exception):
+    pass
+
+
+class PdfTextExtractor(object):
+    def __init__(self, max_processes=PDF_EXTRACT_MAX_PROCESSES, cpu_seconds=PDF_EXTRACT_CPU_SECONDS, memory_bytes=PDF_EXTRACT_MEMORY_BYTES):
+        self.slots = BoundedSemaphore(max_processes)
+        self.cpu_seconds = cpu_seconds
+        self.memory_bytes = memory_bytes
+        self.lock = Lock()
+        self.stats = {
+            "extracted": 0,
+            "timeouts": 0,
+            "memory_errors": 0,
+            "failures": 0,
+            "seconds": 0.0
+        }
+
+    def record(self, outcome, start_time):
+        with self.lock:
+            self.stats[outcome] += 1
+            self.stats["seconds"] += time() - start_time
+
+    def extract(self, pdf_bytes, maxpages=3, stop_when=None):
+        if not PDF_EXTRACT_IN_CHILD_PROCESS:
+            return extract_text_from_pdf_bytes(pdf_bytes, maxpages, stop_when)
+
+        with self.slots:
+            start_time = time()
+            (parent_conn, child_conn) = Pipe(duplex=False)
+            process = Process(target=extract_text_in_child,
+                              args=(child_conn, pdf_bytes, maxpages, stop_when, self.cpu_seconds, self.memory_bytes))
+            process.daemon = True
+            process.start()
+            child_conn.close()
+
+            # cpu time can't run past the rlimit, but a child stuck on io or
+            # swapping could, so also give up on wall clock time
+            wall_seconds = self.cpu_seconds * 2 + 5
+            result = None
+            try:
+                if parent_conn.poll(wall_seconds):
+                    result = parent_conn.recv()
+            except EOFError:
+                # the child died without sending anything, usually killed by the cpu limit
+                pass
+            finally:
+                parent_conn.close()
+                process.join(1)
+                if process.is_alive():
+                    process.terminate()
+                    process.join()
+
+        if not result:
+            self.record("timeouts", start_time)
+            raise PdfTextExtractionError(u"pdf text extraction timed out or was killed (exit code {})".format(process.exitcode))
+
+        (status, value) = result
+        if status == "ok":
+            self.record("extracted", start_time)
+            return value
+        if status == "memory":
+            self.record("memory_errors", start_time)
+            raise PdfTextExtractionError(u"pdf text extraction ran out of memory")
+
+        self.record("failures", start_time)
+        raise PdfTextExtractionError(u"pdf text extraction failed: {}".format(value))
+
+
+pdf_text_extractor = PdfTextExtractor()
+
+
+def convert_pdf_to_txt(r, maxpages=3, stop_when=None):
+    if r.status_code != 200:
+        logger.info(u"error: status code {} in convert_pdf_to_txt".format(r.status_code))
+        return None
+
+    if not r.encoding:
+        r.encoding = "utf-8"
+
+    text = pdf_text_extractor.extract(r.content_big(), maxpages=maxpages, stop_when=stop_when)
     # logger.info(text)
     return text
@@ -1,7 +1,25 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
+import os
+import datetime
+from sqlalchemy import text
+
+from app import db
+from app import logger
 from http_cache import http_get
+from util import chunks
+
+
+# create table pmc_info (pmcid text primary key, has_pdf text, auth_man text,
+#     is_open_access text, license text, updated timestamp);
+# alter table pmc_info add column missing boolean;
+
+# europe pmc takes up to 1000 per page, but the query goes in the url, so keep it shorter than that
+PMC_BATCH_SIZE = 100
+
+# pmcids europe pmc didn't return are stored as missing, and not asked about again until this old
+PMC_INFO_MISS_MAX_AGE_DAYS = float(os.getenv("PMC_INFO_MISS_MAX_AGE_DAYS", 7))
 
 
 # examples
@@ -19,3 +37,103 @@ def query_pmc(query_text):
     data = r.json()
     result_list = data["resultList"]["result"]
     return result_list
+
+
+class PmcInfo(db.Model):
+    pmcid = db.Column(db.Text, primary_key=True)
+    has_pdf = db.Column(db.Text)
+    auth_man = db.Column(db.Text)
+    is_open_access = db.Column(db.Text)
+    license = db.Column(db.Text)
+    updated = db.Column(db.DateTime)
+    missing = db.Column(db.Boolean)
+
+    def __repr__(self):
+        return u"<PmcInfo ( {} ) {} {} {}>".format(self.pmcid, self.has_pdf, self.auth_man, self.license)
+
+
+# one europe pmc call for a whole batch, eg
+# https://www.ebi.ac.uk/europepmc/webservices/rest/search?query=PMCID:PMC3039489 OR PMCID:PMC3606428&resulttype=lite&pageSize=2&format=json&tool=oadoi
+def query_pmc_batch(pmcids):
+    results = {}
+    for pmcid_chunk in chunks(sorted(set(pmcids)), PMC_BATCH_SIZE):
+        query_text = u" OR ".join([u"PMCID:{}".format(pmcid.upper()) for pmcid in pmcid_chunk])
+        url = u"https://www.ebi.ac.uk/europepmc/webservices/rest/search?query={}&resulttype=lite&pageSize={}&format=json&tool=oadoi".format(
+            query_text, len(pmcid_chunk))
+        r = http_get(url)
+        data = r.json()
+        for result in data["resultList"]["result"]:
+            if result.get("pmcid", None):
+                results[result["pmcid"].lower()] = result
+    return results
+
+
+def get_stored_pmc_info(pmcids):
+    # local table only, never the network.  safe to call while recalculating.
+    # pmcids europe pmc didn't know about aren't returned.
+    pmcids = list(set([pmcid.lower() for pmcid in pmcids if pmcid]))
+    if not pmcids:
+        return {}
+    rows = []
+    for pmcid_chunk in chunks(pmcids, 1000):
+        rows += PmcInfo.query.filter(PmcInfo.pmcid.in_(pmcid_chunk), PmcInfo.missing.isnot(True)).all()
+    return dict((row.pmcid, row) for row in rows)
+
+
+def get_recent_pmc_misses(pmcids):
+    pmcids = list(set(pmcids))
+    oldest = datetime.datetime.utcnow() - datetime.timedelta(days=PMC_INFO_MISS_MAX_AGE_DAYS)
+    misses = set()
+    for pmcid_chunk in chunks(pmcids, 1000):
+        rows = db.session.query(PmcInfo.pmcid).filter(
+            PmcInfo.pmcid.in_(pmcid_chunk), PmcInfo.missing == True, PmcInfo.updated >= oldest).all()
+        misses.update([row[0] for row in rows])
+    return misses
+
+
+def save_pmc_info(results):
+    now = datetime.datetime.utcnow()
+    for (pmcid, result) in results.iteritems():
+        db.session.execute(text(u"""
+            insert into pmc_info (pmcid, has_pdf, auth_man, is_open_access, license, updated, missing)
+            values (:pmcid, :has_pdf, :auth_man, :is_open_access, :license, :updated, false)
+            on conflict (pmcid) do update set has_pdf=excluded.has_pdf, auth_man=excluded.auth_man,
+                is_open_access=excluded.is_open_access, license=excluded.license, updated=excluded.updated,
+                missing=false""").bindparams(
+                pmcid=pmcid,
+                has_pdf=result.get("hasPDF", None),
+                auth_man=result.get("authMan", None),
+                is_open_access=result.get("isOpenAccess", None),
+                license=result.get("license", None),
+                updated=now
+            ))
+
+
+def save_pmc_misses(pmcids):
+    now = datetime.datetime.utcnow()
+    for pmcid in pmcids:
+        db.session.execute(text(u"""
+            insert into pmc_info (pmcid, updated, missing)
+            values (:pmcid, :updated, true)
+            on conflict (pmcid) do update set updated=excluded.updated
+                where pmc_info.missing""").bindparams(
+                pmcid=pmcid,
+                updated=now
+            ))
+
+
+def get_pmc_info(pmcids):
+    # the local table first, then one batched europe pmc query for whatever it didn't have,
+    # skipping pmcids it recently told us it doesn't have
+    stored = get_stored_pmc_info(pmcids)
+    missing_pmcids = set([pmcid.lower() for pmcid in pmcids if pmcid and pmcid.lower() not in stored])
+    if missing_pmcids:
+        missing_pmcids -= get_recent_pmc_misses(missing_pmcids)
+    if missing_pmcids:
+        logger.info(u"asking europe pmc about {} pmcids".format(len(missing_pmcids)))
+        results = query_pmc_batch(missing_pmcids)
+        if results:
+            save_pmc_info(results)
+            stored.update(get_stored_pmc_info(results.keys()))
+        save_pmc_misses(missing_pmcids - set(results.keys()))
+    return stored
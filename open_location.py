@@ -1,11 +1,8 @@
 # -*- coding: utf8 -*-
 #
 
-import shortuuid
 import re
-from sqlalchemy import sql
 
-from app import db
 from app import logger
 from oa_pdf import convert_pdf_to_txt
 from util import clean_doi
@@ -51,28 +48,74 @@ def url_sort_score(url):
 
 
 
-class OpenLocation(db.Model):
-    id = db.Column(db.Text, primary_key=True)
-    pub_id = db.Column(db.Text, db.ForeignKey('pub.id'))
-    doi = db.Column(db.Text)  # denormalized from Publication for ease of interpreting
-
-    pdf_url = db.Column(db.Text)
-    metadata_url = db.Column(db.Text)
-    license = db.Column(db.Text)
-    evidence = db.Column(db.Text)
-    updated = db.Column(db.DateTime)
-    error = db.Column(db.Text)
+def derived_property(fn):
+    # computed once, then kept until one of the location's fields changes
+    name = fn.__name__
+
+    def getter(self):
+        derived = self.derived
+        if derived is None:
+            derived = {}
+            object.__setattr__(self, "derived", derived)
+        if name not in derived:
+            derived[name] = fn(self)
+        return derived[name]
+    return property(getter)
+
+
+# a plain value object: pubs build dozens of these on every recalculate and never save
+# them, so no orm instrumentation and no uuid per location
+class OpenLocation(object):
+    __slots__ = [
+        "id",
+        "pub_id",
+        "doi",
+        "pdf_url",
+        "metadata_url",
+        "license",
+        "evidence",
+        "updated",
+        "error",
+        "match",
+        "match_type",
+        "pmh_id",
+        "repo_id",
+        "base_doc",
+        "version",
+        # only set on some locations, so read these with hasattr
+        "is_best",
+        "host_type_set",
+        # memoized derived_property values, see __setattr__
+        "derived"
+    ]
+
+    # set after ranking, and nothing derived depends on it
+    NOT_DERIVED_FROM = set(["is_best", "derived"])
 
     def __init__(self, **kwargs):
-        self.id = shortuuid.uuid()[0:20]
+        self.derived = None
+        self.id = None
+        self.pub_id = None
         self.doi = ""
+        self.pdf_url = None
+        self.metadata_url = None
+        self.license = None
+        self.evidence = None
+        self.updated = None
+        self.error = ""
         self.match = {}
+        self.match_type = None
         self.pmh_id = None
         self.repo_id = None
         self.base_doc = None
         self.version = None
-        self.error = ""
-        super(OpenLocation, self).__init__(**kwargs)
+        for (k, v) in kwargs.iteritems():
+            setattr(self, k, v)
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name not in self.NOT_DERIVED_FROM:
+            object.__setattr__(self, "derived", None)
 
     @property
     def has_license(self):
@@ -82,7 +125,7 @@ class OpenLocation(db.Model):
             return False
         return True
 
-    @property
+    @derived_property
     def best_url(self):
         if self.pdf_url:
             return self.pdf_url
@@ -96,19 +139,19 @@ class OpenLocation(db.Model):
             return True
         return False
 
-    @property
+    @derived_property
     def is_reported_noncompliant(self):
         if is_reported_noncompliant_url(self.doi, self.pdf_url) or is_reported_noncompliant_url(self.doi, self.metadata_url):
             return True
         return False
 
-    @property
+    @derived_property
     def is_gold(self):
         if self.display_evidence and "oa journal" in self.display_evidence:
             return True
         return False
 
-    @property
+    @derived_property
     def display_evidence(self):
         if self.evidence:
             return self.evidence.replace("hybrid", "open")
@@ -120,7 +163,7 @@ class OpenLocation(db.Model):
             return "publisher"
         return "repository"
 
-    @property
+    @derived_property
     def host_type(self):
         if hasattr(self, "host_type_set"):
             return self.host_type_set
@@ -141,7 +184,7 @@ class OpenLocation(db.Model):
         return None
 
 
-    @property
+    @derived_property
     def is_hybrid(self):
         # import pdb; pdb.set_trace()
 
@@ -156,7 +199,7 @@ class OpenLocation(db.Model):
         return False
 
 
-    @property
+    @derived_property
     def oa_color(self):
         if self.is_gold:
             return "gold"
@@ -165,7 +208,7 @@ class OpenLocation(db.Model):
         if self.display_evidence=="closed" or not self.best_url:
             return "gray"
         if not self.display_evidence:
-            logger.info(u"should have evidence for {} but none".format(self.id))
+            logger.info(u"should have evidence for {} but none".format(self))
             return None
         return "green"
 
@@ -176,7 +219,7 @@ class OpenLocation(db.Model):
         return False
 
 
-    @property
+    @derived_property
     def sort_score(self):
 
         score = 0
@@ -208,7 +251,7 @@ class OpenLocation(db.Model):
 
 
     def __repr__(self):
-        return u"<OpenLocation ({}) {} {} {} {}>".format(self.id, self.doi, self.display_evidence, self.pdf_url, self.metadata_url)
+        return u"<OpenLocation {} {} {} {}>".format(self.doi, self.display_evidence, self.pdf_url, self.metadata_url)
 
     def to_dict(self):
         response = {
@@ -17,8 +17,13 @@ from webpage import PmhRepoWebpage
 
 from oa_local import find_normalized_license
 from oa_pdf import convert_pdf_to_txt
-from oa_pmc import query_pmc
+from pdf_verdict import get_pdf_verdict_for_content
+from pdf_verdict import get_pdf_verdict_for_url
+from pdf_verdict import save_pdf_verdict
+from oa_pmc import get_pmc_info
 from http_cache import http_get
+from scrape_engine import ScrapeEngine
+from scrape_engine import ScrapeJob
 from util import remove_punctuation
 from util import get_sql_answer
 from util import is_the_same_url
@@ -27,6 +32,78 @@ from util import normalize_title
 
 DEBUG_BASE = False
 
+published_version_patterns = [
+    re.compile(ur"©.?\d{4}", re.UNICODE),
+    re.compile(ur"\(C\).?\d{4}", re.IGNORECASE),
+    re.compile(ur"copyright \d{4}", re.IGNORECASE),
+    re.compile(ur"all rights reserved", re.IGNORECASE),
+    re.compile(ur"This article is distributed under the terms of the Creative Commons", re.IGNORECASE),
+    re.compile(ur"this is an open access article", re.IGNORECASE)
+    ]
+
+def text_says_published_version(text):
+    if not text:
+        return False
+    return any([pattern.findall(text) for pattern in published_version_patterns])
+
+def text_settles_version_and_license(text):
+    return text_says_published_version(text) and bool(find_normalized_license(text))
+
+
+def set_page_info_from_pmc_info(my_page, pmc_info):
+    my_page.scrape_metadata_url = u"http://europepmc.org/articles/{}".format(my_page.pmcid)
+    if pmc_info.has_pdf == u"Y":
+        my_page.scrape_pdf_url = u"http://europepmc.org/articles/{}?pdf=render".format(my_page.pmcid)
+    if pmc_info.auth_man == u"Y":
+        my_page.scrape_version = u"acceptedVersion"
+    else:
+        my_page.scrape_version = u"publishedVersion"
+    if pmc_info.license:
+        my_page.scrape_license = find_normalized_license(pmc_info.license)
+    elif pmc_info.is_open_access == "Y":
+        my_page.scrape_license = u"implied-oa"
+
+
+# what start_scrape resets
+PAGE_SCRAPE_COLUMNS = ["updated", "scrape_updated", "scrape_pdf_url", "scrape_metadata_url", "scrape_license", "scrape_version", "error"]
+
+
+def scrape_pages_concurrently(pages, engine=None):
+    # same as calling scrape_if_matches_pub() on each page, but the landing pages
+    # are scraped concurrently, and the db work happens back on this thread
+    if not engine:
+        engine = ScrapeEngine()
+
+    # one batched europe pmc query for the chunk, so set_info_for_pmc_page finds them locally
+    get_pmc_info([my_page.pmcid for my_page in pages if my_page.is_pmc])
+
+    jobs = []
+    pages_to_finish = []
+    for my_page in pages:
+        my_page.num_pub_matches = my_page.query_for_num_pub_matches()
+        if not my_page.num_pub_matches > 0:
+            continue
+
+        # start_scrape clears these, so keep them to put back if the scrape doesn't finish
+        old_scrape_values = dict((column, getattr(my_page, column)) for column in PAGE_SCRAPE_COLUMNS)
+        my_webpage = my_page.start_scrape()
+        job = None
+        if my_webpage and not my_page.scrape_pdf_url:
+            job = ScrapeJob(my_webpage.url, my_webpage.scrape_for_fulltext_link)
+            jobs.append(job)
+        pages_to_finish.append((my_page, my_webpage, job, old_scrape_values))
+
+    engine.run(jobs)
+
+    for (my_page, my_webpage, job, old_scrape_values) in pages_to_finish:
+        if job and not job.succeeded:
+            # leave it as it was, so a slow chunk doesn't wipe what earlier scrapes found
+            logger.info(u"scrape didn't finish in the scrape engine for {}".format(my_page))
+            for (column, value) in old_scrape_values.iteritems():
+                setattr(my_page, column, value)
+            continue
+        my_page.finish_scrape(my_webpage)
+
 
 class PageNew(db.Model):
     id = db.Column(db.Text, primary_key=True)
@@ -108,33 +185,20 @@ class PageNew(db.Model):
         if not self.pmcid:
             return
 
-        result_list = query_pmc(self.pmcid)
-        if not result_list:
-            return
-        result = result_list[0]
-        has_pdf = result.get("hasPDF", None)
-        is_author_manuscript = result.get("authMan", None)
-        is_open_access = result.get("isOpenAccess", None)
-        raw_license = result.get("license", None)
-
-        self.scrape_metadata_url = u"http://europepmc.org/articles/{}".format(self.pmcid)
-        if has_pdf == u"Y":
-            self.scrape_pdf_url = u"http://europepmc.org/articles/{}?pdf=render".format(self.pmcid)
-        if is_author_manuscript == u"Y":
-            self.scrape_version = u"acceptedVersion"
-        else:
-            self.scrape_version = u"publishedVersion"
-        if raw_license:
-            self.scrape_license = find_normalized_license(raw_license)
-        elif is_open_access == "Y":
-            self.scrape_license = u"implied-oa"
-
-        # except Exception as e:
-        #     self.error += u"Exception in set_info_for_pmc_page"
-        #     logger.info(u"Exception in set_info_for_pmc_page")
+        pmc_infos = get_pmc_info([self.pmcid])
+        pmc_info = pmc_infos.get(self.pmcid, None)
+        if pmc_info:
+            set_page_info_from_pmc_info(self, pmc_info)
 
 
     def scrape(self):
+        my_webpage = self.start_scrape()
+        if my_webpage and not self.scrape_pdf_url:
+            my_webpage.scrape_for_fulltext_link()
+        self.finish_scrape(my_webpage)
+
+    # split out of scrape() so scrape_pages_concurrently can run the landing page scrape elsewhere
+    def start_scrape(self):
         self.updated = datetime.datetime.utcnow().isoformat()
         self.scrape_updated = datetime.datetime.utcnow().isoformat()
         self.scrape_pdf_url = None
@@ -151,9 +215,13 @@ class PageNew(db.Model):
             self.set_info_for_pmc_page()
 
         if not self.scrape_pdf_url or not self.scrape_version:
-            with PmhRepoWebpage(url=self.url, scraped_pdf_url=self.scrape_pdf_url, repo_id=self.repo_id) as my_webpage:
+            return PmhRepoWebpage(url=self.url, scraped_pdf_url=self.scrape_pdf_url, repo_id=self.repo_id)
+        return None
+
+    def finish_scrape(self, my_webpage):
+        if my_webpage:
+            with my_webpage:
                 if not self.scrape_pdf_url:
-                    my_webpage.scrape_for_fulltext_link()
                     self.error += my_webpage.error
                     if my_webpage.is_open:
                         logger.info(u"** found an open copy! {}".format(my_webpage.fulltext_url))
@@ -169,11 +237,23 @@ class PageNew(db.Model):
                     self.set_version_and_license(r=my_webpage.r)
 
         if self.scrape_pdf_url and not self.scrape_version:
+            # a pdf url we worked out recently doesn't need downloading again
+            if not self.is_pmc and self.use_saved_pdf_verdict(get_pdf_verdict_for_url(self.scrape_pdf_url)):
+                return
             with PmhRepoWebpage(url=self.url, scraped_pdf_url=self.scrape_pdf_url, repo_id=self.repo_id) as my_webpage:
                 my_webpage.set_r_for_pdf()
                 self.set_version_and_license(r=my_webpage.r)
 
 
+    def use_saved_pdf_verdict(self, my_verdict):
+        if not my_verdict:
+            return False
+        logger.info(u"using saved pdf verdict for {}: {}".format(self.url, my_verdict))
+        self.scrape_version = my_verdict.version
+        if my_verdict.license:
+            self.scrape_license = my_verdict.license
+        return True
+
     # use standards from https://wiki.surfnet.nl/display/DRIVERguidelines/Version+vocabulary
     # submittedVersion, acceptedVersion, publishedVersion
     def set_version_and_license(self, r=None):
@@ -189,26 +269,23 @@ class PageNew(db.Model):
             return
 
         try:
+            # the same pdf turns up under lots of pages, so reuse what we worked out last time.
+            # we already have the body, so match on its hash: the pdf at a url can change.
+            if self.use_saved_pdf_verdict(get_pdf_verdict_for_content(r.content_big())):
+                return
+
             # http://crossmark.dyndns.org/dialog/?doi=10.1016/j.jml.2012 at http://dspace.mit.edu/bitstream/1721.1/102417/1/Gibson_The%20syntactic.pdf
-            if re.findall(u"crossmark\.[^/]*\.org/", r.content_big(), re.IGNORECASE):
+            has_crossmark = bool(re.findall(u"crossmark\.[^/]*\.org/", r.content_big(), re.IGNORECASE))
+            if has_crossmark:
                 self.scrape_version = "publishedVersion"
 
-            text = convert_pdf_to_txt(r)
+            # the first page is usually enough, so stop parsing once it settles both questions
+            text = convert_pdf_to_txt(r, maxpages=3, stop_when=text_settles_version_and_license)
+
             # logger.info(text)
             if text and self.scrape_version == "submittedVersion":
-                patterns = [
-                    re.compile(ur"©.?\d{4}", re.UNICODE),
-                    re.compile(ur"\(C\).?\d{4}", re.IGNORECASE),
-                    re.compile(ur"copyright \d{4}", re.IGNORECASE),
-                    re.compile(ur"all rights reserved", re.IGNORECASE),
-                    re.compile(ur"This article is distributed under the terms of the Creative Commons", re.IGNORECASE),
-                    re.compile(ur"this is an open access article", re.IGNORECASE)
-                    ]
-
-                for pattern in patterns:
-                    matches = pattern.findall(text)
-                    if matches:
-                        self.scrape_version = "publishedVersion"
+                if text_says_published_version(text):
+                    self.scrape_version = "publishedVersion"
 
             logger.info(u"returning {} with scrape_version: {}".format(self.url, self.scrape_version))
 
@@ -216,6 +293,9 @@ class PageNew(db.Model):
             if open_license:
                 self.scrape_license = open_license
 
+            if r.status_code == 200:
+                save_pdf_verdict(r.url, r.content_big(), self.scrape_version, open_license, has_crossmark)
+
         except Exception as e:
             logger.exception(u"exception in convert_pdf_to_txt for {}".format(self.url))
             self.error += u"Exception doing convert_pdf_to_txt!"
@@ -340,45 +420,6 @@ class Page(db.Model):
         return False
 
 
-    # examples
-    # https://www.ebi.ac.uk/europepmc/webservices/rest/search?query=PMC3039489&resulttype=core&format=json&tool=oadoi
-    # https://www.ebi.ac.uk/europepmc/webservices/rest/search?query=PMC3606428&resulttype=core&format=json&tool=oadoi
-    def set_info_for_pmc_page(self):
-        if not self.pmcid:
-            return
-
-        url_template = u"https://www.ebi.ac.uk/europepmc/webservices/rest/search?query={}&resulttype=core&format=json&tool=oadoi"
-        url = url_template.format(self.pmcid)
-
-        # try:
-        r = http_get(url)
-        data = r.json()
-        result_list = data["resultList"]["result"]
-        if not result_list:
-            return
-        result = result_list[0]
-        has_pdf = result.get("hasPDF", None)
-        is_author_manuscript = result.get("authMan", None)
-        is_open_access = result.get("isOpenAccess", None)
-        raw_license = result.get("license", None)
-
-        self.scrape_metadata_url = u"http://europepmc.org/articles/{}".format(self.pmcid)
-        if has_pdf == u"Y":
-            self.scrape_pdf_url = u"http://europepmc.org/articles/{}?pdf=render".format(self.pmcid)
-        if is_author_manuscript == u"Y":
-            self.scrape_version = u"acceptedVersion"
-        else:
-            self.scrape_version = u"publishedVersion"
-        if raw_license:
-            self.scrape_license = find_normalized_license(raw_license)
-        elif is_open_access == "Y":
-            self.scrape_license = u"implied-oa"
-
-        # except Exception as e:
-        #     self.error += u"Exception in set_info_for_pmc_page"
-        #     logger.info(u"Exception in set_info_for_pmc_page")
-
-
     def __repr__(self):
         return u"<Page ( {} ) {} doi:{} '{}...'>".format(self.pmh_id, self.url, self.doi, self.title[0:20])
 
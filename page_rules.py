@@ -0,0 +1,151 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import re
+from threading import Lock
+from time import time
+
+from util import normalize
+
+
+class PageRule(object):
+    def __init__(self, pattern, flags=re.IGNORECASE, publisher=None, url_snippet=None):
+        self.pattern = pattern
+        self.flags = flags
+        self.regex = re.compile(pattern, flags)
+        self.publisher = publisher
+        self.normalized_publisher = normalize(publisher) if publisher else None
+        self.url_snippet = url_snippet
+        self.num_matches = 0
+
+    def applies_to(self, normalized_publisher, url):
+        if self.normalized_publisher and self.normalized_publisher != normalized_publisher:
+            return False
+        if self.url_snippet and (not url or self.url_snippet not in url.lower()):
+            return False
+        return True
+
+    def to_dict(self):
+        return {
+            "pattern": self.pattern,
+            "publisher": self.publisher,
+            "url_snippet": self.url_snippet,
+            "num_matches": self.num_matches
+        }
+
+
+class PageRuleSet(object):
+    """
+    Regexes for one kind of check on a landing page, compiled once at import.
+    Rules for other publishers (or urls) are dropped before any regex runs, and
+    first_match runs everything left as one alternation, in one pass over the page.
+    """
+    def __init__(self, name, rules):
+        self.name = name
+        self.rules = rules
+        self.num_calls = 0
+        self.seconds = 0.0
+        self.combined_regexes = {}
+        self.lock = Lock()
+
+    def applicable_rules(self, publisher=None, url=None):
+        normalized_publisher = normalize(publisher) if publisher else None
+        return [rule for rule in self.rules if rule.applies_to(normalized_publisher, url)]
+
+    def combined_regex(self, rules):
+        # one alternation per combination of rules we've seen, usually one per publisher
+        key = tuple([id(rule) for rule in rules])
+        with self.lock:
+            if key not in self.combined_regexes:
+                pattern = u"|".join([u"(?P<rule{}>{})".format(index, rule.pattern) for (index, rule) in enumerate(rules)])
+                self.combined_regexes[key] = re.compile(pattern, rules[0].flags)
+            return self.combined_regexes[key]
+
+    def first_match(self, text, publisher=None, url=None):
+        start_time = time()
+        matching_rule = None
+
+        rules = self.applicable_rules(publisher, url)
+        if rules and text:
+            # can only combine rules that use the same flags
+            flag_groups = []
+            for rule in rules:
+                if flag_groups and flag_groups[-1][0].flags == rule.flags:
+                    flag_groups[-1].append(rule)
+                else:
+                    flag_groups.append([rule])
+
+            for flag_group in flag_groups:
+                match = self.combined_regex(flag_group).search(text)
+                if match:
+                    for (index, rule) in enumerate(flag_group):
+                        if match.group(u"rule{}".format(index)) is not None:
+                            matching_rule = rule
+                            break
+                    break
+
+        self.record(start_time, [matching_rule] if matching_rule else [])
+        return matching_rule
+
+    def all_matches(self, text, publisher=None, url=None):
+        # every applicable rule that matches, in order, with what re.findall would have returned first
+        start_time = time()
+        matches = []
+        if text:
+            for rule in self.applicable_rules(publisher, url):
+                rule_matches = rule.regex.findall(text)
+                if rule_matches:
+                    matches.append((rule, rule_matches[0]))
+
+        self.record(start_time, [rule for (rule, first_match) in matches])
+        return matches
+
+    def record(self, start_time, matching_rules):
+        with self.lock:
+            self.num_calls += 1
+            self.seconds += time() - start_time
+            for rule in matching_rules:
+                rule.num_matches += 1
+
+    def to_dict(self):
+        return {
+            "num_calls": self.num_calls,
+            "seconds": round(self.seconds, 3),
+            "rules": [rule.to_dict() for rule in self.rules]
+        }
+
+
+license_rules = PageRuleSet("license", [
+    PageRule(u"(creativecommons.org\/licenses\/[a-z\-]+)"),
+    PageRule(u"distributed under the terms (.*) which permits"),
+    PageRule(u"This is an open access article under the terms (.*) which permits"),
+    PageRule(u"This is an open access article published under (.*) which permits"),
+    PageRule(u'<div class="openAccess-articleHeaderContainer(.*?)</div>')
+])
+
+says_open_url_snippet_rules = PageRuleSet("says_open_url_snippet", [
+    PageRule(u'<strong>Full-text: Open access</strong>', url_snippet=u"projecteuclid.org/")
+])
+
+says_open_access_rules = PageRuleSet("says_open_access", [
+    PageRule(u"/accessOA.png", re.IGNORECASE | re.DOTALL, publisher="Informa UK Limited"),
+    PageRule(u"<i class='icon-availability_open'", re.IGNORECASE | re.DOTALL, publisher="Oxford University Press (OUP)"),
+    PageRule(ur'"isOpenAccess":true', re.IGNORECASE | re.DOTALL, publisher="Institute of Electrical and Electronics Engineers (IEEE)"),
+    PageRule(ur'"openAccessFlag":"yes"', re.IGNORECASE | re.DOTALL, publisher="Institute of Electrical and Electronics Engineers (IEEE)"),
+    PageRule(u"/open_access_blue.png", re.IGNORECASE | re.DOTALL, publisher="Royal Society of Chemistry (RSC)"),
+    PageRule(u'<span class="icon access open-access cursorDefault">', re.IGNORECASE | re.DOTALL, publisher="Cambridge University Press (CUP)")
+])
+
+says_free_publisher_rules = PageRuleSet("says_free_publisher", [
+    PageRule(u'<span class="freeAccess" title="You have free access to this content">', re.IGNORECASE | re.DOTALL, publisher="Wiley-Blackwell"),
+    PageRule(u'<iframe id="pdfDocument"', re.IGNORECASE | re.DOTALL, publisher="Wiley-Blackwell"),
+    PageRule(ur'<li class="download-pdf-button">.*Download PDF.*</li>', re.IGNORECASE | re.DOTALL, publisher="JSTOR"),
+    PageRule(ur'<frame src="http://ieeexplore.ieee.org/.*?pdf.*?</frameset>', re.IGNORECASE | re.DOTALL, publisher="Institute of Electrical and Electronics Engineers (IEEE)"),
+    PageRule(ur'Full Refereed Journal Article', re.IGNORECASE | re.DOTALL, publisher="IOP Publishing")
+])
+
+all_page_rule_sets = [license_rules, says_open_url_snippet_rules, says_open_access_rules, says_free_publisher_rules]
+
+
+def page_rule_stats():
+    return dict((rule_set.name, rule_set.to_dict()) for rule_set in all_page_rule_sets)
@@ -0,0 +1,67 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import hashlib
+import datetime
+from sqlalchemy import text
+
+from app import db
+from app import logger
+
+
+# the pdf at a url can be replaced, so verdicts looked up by url alone are only trusted this long
+PDF_VERDICT_URL_MAX_AGE_DAYS = float(os.getenv("PDF_VERDICT_URL_MAX_AGE_DAYS", 30))
+
+
+# create table pdf_verdict (id text primary key, url text, version text, license text,
+#     crossmark boolean, created timestamp);
+# create index pdf_verdict_url_idx on pdf_verdict (url);
+
+class PdfVerdict(db.Model):
+    # id is the sha1 of the pdf bytes
+    id = db.Column(db.Text, primary_key=True)
+    url = db.Column(db.Text)
+    version = db.Column(db.Text)
+    license = db.Column(db.Text)
+    crossmark = db.Column(db.Boolean)
+    created = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return u"<PdfVerdict ( {} ) {} {} {}>".format(self.id, self.url, self.version, self.license)
+
+
+def pdf_content_hash(content):
+    return hashlib.sha1(content).hexdigest()
+
+
+def get_pdf_verdict_for_url(url):
+    # PageNew.finish_scrape checks this before downloading a pdf, so urls it has seen recently
+    # are skipped.  once we have the body, get_pdf_verdict_for_content is exact.
+    if not url:
+        return None
+    oldest = datetime.datetime.utcnow() - datetime.timedelta(days=PDF_VERDICT_URL_MAX_AGE_DAYS)
+    return PdfVerdict.query.filter(PdfVerdict.url == url, PdfVerdict.created >= oldest).order_by(PdfVerdict.created.desc()).first()
+
+
+def get_pdf_verdict_for_content(content):
+    if not content:
+        return None
+    return PdfVerdict.query.get(pdf_content_hash(content))
+
+
+def save_pdf_verdict(url, content, version, license, crossmark):
+    # lots of workers see the same pdfs, so ignore it if someone else got there first
+    # instead of failing the whole chunk's commit
+    db.session.execute(text(u"""
+        insert into pdf_verdict (id, url, version, license, crossmark, created)
+        values (:id, :url, :version, :license, :crossmark, :created)
+        on conflict do nothing""").bindparams(
+            id=pdf_content_hash(content),
+            url=url,
+            version=version,
+            license=license,
+            crossmark=crossmark,
+            created=datetime.datetime.utcnow()
+        ))
+    logger.info(u"saved pdf verdict for {}: {} {}".format(url, version, license))
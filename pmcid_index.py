@@ -0,0 +1,103 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import mmap
+from time import time
+
+from app import db
+from app import logger
+from util import elapsed
+
+
+# a sorted, tab-separated file of doi -> pmcid, release date, version.  when this is set
+# (and the file exists), ask_pmc binary-searches it instead of loading pmcid_lookup rows
+# for every pub.  the file is mmap'd, so all the workers on a machine share one copy.
+PMCID_INDEX_FILE = os.getenv("PMCID_INDEX_FILE", None)
+
+
+# python -c 'import pmcid_index; pmcid_index.build_pmcid_index_file("data/pmcid_index.tsv");'
+# run after oa_local.update_pmcid_lookup
+def build_pmcid_index_file(filename):
+    start_time = time()
+    temp_filename = u"{}.tmp".format(filename)
+
+    # collate "C" so postgres sorts the same way python compares byte strings
+    query = u"""select l.doi, l.pmcid, l.release_date, (v.pmcid is not null) as is_published
+        from pmcid_lookup l
+        left join pmcid_published_version_lookup v on v.pmcid = l.pmcid
+        where l.doi is not null
+        order by l.doi collate "C" """
+
+    num_rows = 0
+    connection = db.engine.raw_connection()
+    try:
+        # named cursor, so the rows stream instead of all coming back at once
+        cursor = connection.cursor("pmcid_index_cursor")
+        cursor.itersize = 100*1000
+        cursor.execute(query)
+        with open(temp_filename, "w") as outfile:
+            for (doi, pmcid, release_date, is_published) in cursor:
+                version = "publishedVersion" if is_published else "acceptedVersion"
+                line = u"\t".join([doi, pmcid or u"", release_date or u"", version])
+                outfile.write(line.encode("utf-8").replace("\n", " ") + "\n")
+                num_rows += 1
+    finally:
+        connection.close()
+
+    os.rename(temp_filename, filename)
+    logger.info(u"wrote {} rows to {} in {} seconds".format(num_rows, filename, elapsed(start_time)))
+
+
+class PmcidIndex(object):
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def line_at(self, offset):
+        # the whole line that starts at or before offset
+        start = self.data.rfind("\n", 0, offset) + 1
+        end = self.data.find("\n", offset)
+        if end == -1:
+            end = len(self.data)
+        return (start, end, self.data[start:end])
+
+    def get(self, doi):
+        if not doi:
+            return []
+        key = doi.encode("utf-8")
+
+        # binary search on byte offsets, then read the lines around where we land
+        low = 0
+        high = len(self.data)
+        while low < high:
+            middle = (low + high) // 2
+            (start, end, line) = self.line_at(middle)
+            if line.split("\t", 1)[0] < key:
+                low = end + 1
+            else:
+                high = start
+
+        results = []
+        offset = low
+        while offset < len(self.data):
+            (start, end, line) = self.line_at(offset)
+            columns = line.split("\t")
+            if columns[0] != key:
+                break
+            results.append((columns[1].decode("utf-8"), columns[2].decode("utf-8"), columns[3].decode("utf-8")))
+            offset = end + 1
+        return results
+
+
+def load_pmcid_index():
+    if not PMCID_INDEX_FILE:
+        return None
+    if not os.path.exists(PMCID_INDEX_FILE):
+        logger.info(u"PMCID_INDEX_FILE {} doesn't exist, using pmcid_lookup".format(PMCID_INDEX_FILE))
+        return None
+    return PmcidIndex(PMCID_INDEX_FILE)
+
+
+pmcid_index = load_pmcid_index()
@@ -17,10 +17,29 @@ from util import elapsed
 from util import is_doi_url
 from util import clean_doi
 from util import NoDoiException
+from multi_matcher import MultiMatcher
 
 
 DEBUG_BASE = False
 
+# urls from pmh records that we know are closed or otherwise not useful
+BLACKLIST_URL_SNIPPETS = [
+    u"/10.1093/analys/",
+    u"academic.oup.com/analysis",
+    u"analysis.oxfordjournals.org/",
+    u"ncbi.nlm.nih.gov/pubmed/",
+    u"gateway.webofknowledge.com/",
+    u"orcid.org/",
+    u"researchgate.net/",
+    u"academia.edu/",
+    u"europepmc.org/abstract/",
+    u"ftp://",
+    u"api.crossref",
+    u"api.elsevier",
+    u"api.osf"
+]
+blacklist_url_matcher = MultiMatcher(BLACKLIST_URL_SNIPPETS)
+
 
 
 
@@ -198,23 +217,7 @@ class PmhRecord(db.Model):
             valid_urls = [url for url in valid_urls if u"doi.org/" not in url]
 
         # filter out some urls that we know are closed or otherwise not useful
-        blacklist_url_snippets = [
-            u"/10.1093/analys/",
-            u"academic.oup.com/analysis",
-            u"analysis.oxfordjournals.org/",
-            u"ncbi.nlm.nih.gov/pubmed/",
-            u"gateway.webofknowledge.com/",
-            u"orcid.org/",
-            u"researchgate.net/",
-            u"academia.edu/",
-            u"europepmc.org/abstract/",
-            u"ftp://",
-            u"api.crossref",
-            u"api.elsevier",
-            u"api.osf"
-        ]
-        for url_snippet in blacklist_url_snippets:
-            valid_urls = [url for url in valid_urls if url_snippet not in url]
+        valid_urls = [url for url in valid_urls if not blacklist_url_matcher.matches(url)]
 
 
         # and then html unescape them, because some are html escaped
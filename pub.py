@@ -1,17 +1,24 @@
 from time import time
 import datetime
+import os
 from lxml import etree
 from threading import Thread
+from functools import partial
 import requests
 import shortuuid
 import re
 import random
 import json
+import hashlib
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm.attributes import flag_modified
 from sqlalchemy import orm
+from sqlalchemy import event
+from sqlalchemy import func
+from sqlalchemy import literal_column
 from collections import Counter
 from collections import defaultdict
+from collections import namedtuple
 
 from app import db
 from app import logger
@@ -22,6 +29,7 @@ from util import normalize
 from util import normalize_title
 from util import elapsed
 from util import delete_key_from_dict
+from util import chunks
 import oa_local
 from oa_pmc import query_pmc
 from pmh_record import PmhRecord
@@ -35,8 +43,116 @@ from webpage import PublisherWebpage
 from http_cache import get_session_id
 from page import PageDoiMatch
 from page import PageTitleMatch
+from page import set_page_info_from_pmc_info
+from oa_pmc import get_pmc_info
+from pmcid_index import pmcid_index
+from response_cache import response_cache
+from scrape_engine import ScrapeEngine
+from scrape_engine import ScrapeJob
+
+
+# the v2 api serves the stored response_jsonb unless it is older than these.
+# data_standard is what to_dict_v1 calls the algorithm_version.
+STORED_RESPONSE_MIN_DATA_STANDARD = int(os.getenv("STORED_RESPONSE_MIN_DATA_STANDARD", 0))
+STORED_RESPONSE_MAX_AGE_DAYS = os.getenv("STORED_RESPONSE_MAX_AGE_DAYS", None)
+
+
+# the jsonb columns and the relationships are deferred, so a plain query only gets the
+# small columns.  callers say what they need by picking one of these:
+# (columns to load, or None for all of them; relationships to load up front)
+PUB_LOAD_PROFILES = {
+    "id_only": (["id"], []),
+    "response_only": (["id", "response_jsonb", "updated", "last_changed_date"], []),
+    # with a pmcid index ask_pmc doesn't need pmcid_links
+    "full_recalculate": (None, (["pmcid_links"] if not pmcid_index else []) +
+                         ["page_matches_by_doi", "page_new_matches_by_doi", "page_new_matches_by_title"]),
+    # pub_batch.update_pubs_in_batch loads the relationships itself, for the whole chunk
+    "batch_recalculate": (None, [])
+}
+
+
+def pub_load_options(profile):
+    (column_names, relationship_names) = PUB_LOAD_PROFILES[profile]
+    if column_names:
+        options = [orm.load_only(*column_names)]
+    else:
+        options = [orm.undefer("*")]
+    options += [orm.subqueryload(name) for name in relationship_names]
+    options.append(orm.lazyload("*"))
+    return options
+
+
+def query_pubs(profile):
+    return db.session.query(Pub).options(*pub_load_options(profile))
+
+
+# roughly how many bytes each profile pulls out of postgres for these dois, eg
+# python -c 'import pub; pub.measure_pub_load_profiles(["10.1038/nature12373", "10.1016/j.jbiotec.2005.05.001"]);'
+def measure_pub_load_profiles(dois):
+    bytes_by_profile = {}
+    for (profile, (column_names, relationship_names)) in PUB_LOAD_PROFILES.iteritems():
+        columns = [getattr(Pub, name) for name in column_names or Pub.__table__.columns.keys()]
+        row = db.session.query(*[func.sum(func.pg_column_size(column)) for column in columns]).\
+            filter(Pub.id.in_(dois)).one()
+        num_bytes = sum([column_bytes or 0 for column_bytes in row])
+
+        for name in relationship_names:
+            relationship = getattr(Pub, name)
+            related_table = relationship.property.mapper.local_table
+            related_bytes = db.session.query(func.sum(func.pg_column_size(literal_column(u"{}.*".format(related_table.name))))).\
+                select_from(Pub).join(relationship).filter(Pub.id.in_(dois)).scalar()
+            num_bytes += related_bytes or 0
+
+        bytes_by_profile[profile] = num_bytes
+        logger.info(u"pub load profile {}: {} bytes for {} dois".format(profile, num_bytes, len(dois)))
+    return bytes_by_profile
 
 
+# keys that change without the response really changing, at any depth (eg oa_locations[].updated)
+RESPONSE_VOLATILE_KEYS = set(["updated", "last_changed_date", "x_reported_noncompliant_copies", "x_error", "data_standard"])
+
+
+def without_volatile_keys(value):
+    if isinstance(value, dict):
+        return dict((k, without_volatile_keys(v)) for (k, v) in value.iteritems() if k not in RESPONSE_VOLATILE_KEYS)
+    if isinstance(value, list):
+        return [without_volatile_keys(v) for v in value]
+    return value
+
+
+def get_response_fingerprint(response):
+    # a stable hash of the response, so has_changed is one compare.  sort_keys so key order doesn't matter.
+    if not response:
+        return None
+    canonical_json = json.dumps(without_volatile_keys(response), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(canonical_json).hexdigest()
+
+
+# open locations ranked best first, without the reported noncompliant ones, and that
+# again with duplicate urls dropped.  built once per decide_if_open.
+LocationRanking = namedtuple("LocationRanking", ["sorted_locations", "deduped_locations"])
+
+
+def rank_locations(open_locations):
+    # one sort on (sort_score, best_url) gives the same order as sorting by best_url and
+    # then by sort_score, so ties are still handled consistently
+    sorted_locations = sorted(open_locations, key=lambda x: (x.sort_score, x.best_url))
+    sorted_locations = tuple([location for location in sorted_locations if not location.is_reported_noncompliant])
+
+    deduped_locations = []
+    urls_so_far = set()
+    for location in sorted_locations:
+        if location.best_url not in urls_so_far:
+            urls_so_far.add(location.best_url)
+            deduped_locations.append(location)
+
+    for location in deduped_locations:
+        location.is_best = False
+    if deduped_locations:
+        deduped_locations[0].is_best = True
+
+    return LocationRanking(sorted_locations, tuple(deduped_locations))
+
 
 def build_new_pub(doi, crossref_api):
     my_pub = Pub(id=doi, crossref_api_raw_new=crossref_api)
@@ -103,16 +219,84 @@ def call_args_in_parallel(target, args_list):
     # logger.info(u"finished the calls to {}".format(targets))
 
 
+# only touches my_webpage, so it can run on a scrape engine thread.  returns the error, if any.
+def scrape_webpage_for_open_location(my_webpage):
+    # logger.info(u"scraping", url)
+    error = None
+    try:
+        my_webpage.scrape_for_fulltext_link()
+    except requests.Timeout, e:
+        error = "Timeout in scrape_page_for_open_location on {}: {}".format(my_webpage, unicode(e.message).encode("utf-8"))
+    except requests.exceptions.ConnectionError, e:
+        error = "ConnectionError in scrape_page_for_open_location on {}: {}".format(my_webpage, unicode(e.message).encode("utf-8"))
+    except requests.exceptions.ChunkedEncodingError, e:
+        error = "ChunkedEncodingError in scrape_page_for_open_location on {}: {}".format(my_webpage, unicode(e.message).encode("utf-8"))
+    except requests.exceptions.RequestException, e:
+        error = "RequestException in scrape_page_for_open_location on {}: {}".format(my_webpage, unicode(e.message).encode("utf-8"))
+    except etree.XMLSyntaxError, e:
+        error = "XMLSyntaxError in scrape_page_for_open_location on {}: {}".format(my_webpage, unicode(e.message).encode("utf-8"))
+    except Exception, e:
+        logger.exception(u"Exception in scrape_page_for_open_location")
+        error = "Exception in scrape_page_for_open_location"
+    if error:
+        logger.info(error)
+    return error
+
+
+# what start_hybrid_scrape resets
+HYBRID_SCRAPE_COLUMNS = ["scrape_updated", "scrape_evidence", "scrape_pdf_url", "scrape_metadata_url", "scrape_license"]
+
+
+def refresh_pubs_concurrently(pubs, engine=None):
+    # same as calling refresh() on each pub, but the landing pages are scraped
+    # concurrently, and the db work happens back on this thread
+    if not engine:
+        engine = ScrapeEngine()
+
+    jobs = []
+    scraped_pubs = []
+    old_scrape_values = {}
+    for my_pub in pubs:
+        my_pub.session_id = get_session_id()
+        # start_hybrid_scrape clears these, so keep them to put back if the scrape doesn't finish
+        old_scrape_values[my_pub.id] = dict((column, getattr(my_pub, column)) for column in HYBRID_SCRAPE_COLUMNS)
+        publisher_landing_page = my_pub.start_hybrid_scrape()
+        if publisher_landing_page:
+            # the job only touches the landing page.  the pub is updated back here, and only
+            # if the job finished, since a timed-out job's thread keeps running.
+            jobs.append(ScrapeJob(publisher_landing_page.url,
+                                  partial(scrape_webpage_for_open_location, publisher_landing_page)))
+            scraped_pubs.append((my_pub, publisher_landing_page))
+
+    # end the session before the scrape
+    db.session.close()
+
+    engine.run(jobs)
+
+    for (job, (my_pub, publisher_landing_page)) in zip(jobs, scraped_pubs):
+        if job.succeeded:
+            my_pub.add_scraped_open_location(publisher_landing_page, job.result)
+            my_pub.set_hybrid_scrape_results(publisher_landing_page)
+        else:
+            # leave it for the next refresh, without losing what the last one found
+            for (column, value) in old_scrape_values[my_pub.id].iteritems():
+                setattr(my_pub, column, value)
+
+    for my_pub in pubs:
+        my_pub.update()
+        db.session.merge(my_pub)
+
+
 def lookup_product_by_doi(doi):
     biblio = {"doi": doi}
     return lookup_product(**biblio)
 
 
-def lookup_product(**biblio):
+def lookup_product(load_profile="full_recalculate", **biblio):
     my_pub = None
     if "doi" in biblio and biblio["doi"]:
         doi = clean_doi(biblio["doi"])
-        my_pub = Pub.query.get(doi)
+        my_pub = query_pubs(load_profile).filter(Pub.id == doi).first()
         if my_pub:
             # logger.info(u"found {} in pub db table!".format(my_pub.id))
             my_pub.reset_vars()
@@ -146,8 +330,60 @@ def get_pubs_from_biblio(biblios, run_with_hybrid=False):
     return returned_pubs
 
 
-def get_pub_from_biblio(biblio, run_with_hybrid=False, skip_all_hybrid=False):
-    my_pub = lookup_product(**biblio)
+def stored_response_is_fresh(response_jsonb, updated):
+    if not response_jsonb:
+        return False
+
+    if (response_jsonb.get("data_standard", None) or 0) < STORED_RESPONSE_MIN_DATA_STANDARD:
+        return False
+
+    if STORED_RESPONSE_MAX_AGE_DAYS:
+        if not updated:
+            return False
+        max_age = datetime.timedelta(days=float(STORED_RESPONSE_MAX_AGE_DAYS))
+        if datetime.datetime.utcnow() - updated > max_age:
+            return False
+
+    return True
+
+
+# returns the stored v2 response, or None if it needs to be recalculated
+def get_stored_response_from_doi(dirty_doi):
+    doi = clean_doi(dirty_doi)
+    my_pub = query_pubs("response_only").filter(Pub.id == doi).first()
+    if not my_pub:
+        raise NoDoiException
+
+    if stored_response_is_fresh(my_pub.response_jsonb, my_pub.updated or my_pub.last_changed_date):
+        return my_pub.response_jsonb
+    return None
+
+
+# what the response cache checks its entries against.  the fingerprint changes whenever the
+# stored response does, whichever process recalculated it.  None if we don't have the doi.
+def get_response_cache_validator(clean_doi):
+    row = db.session.query(Pub.response_fingerprint, Pub.last_changed_date).filter(Pub.id == clean_doi).first()
+    if not row:
+        return None
+    (response_fingerprint, last_changed_date) = row
+    # rows from before the fingerprint column
+    if not response_fingerprint and last_changed_date:
+        return last_changed_date.isoformat()
+    return response_fingerprint or u""
+
+
+# yields (doi, is_in_db, response_jsonb) in the order given.  response_jsonb is None for dois
+# we don't have, and for pubs that haven't been calculated yet.
+def get_stored_responses_from_dois(clean_dois, chunk_size=1000):
+    for doi_chunk in chunks(clean_dois, chunk_size):
+        rows = db.session.query(Pub.id, Pub.response_jsonb).filter(Pub.id.in_(doi_chunk)).all()
+        responses_by_doi = dict(rows)
+        for doi in doi_chunk:
+            yield (doi, doi in responses_by_doi, responses_by_doi.get(doi, None))
+
+
+def get_pub_from_biblio(biblio, run_with_hybrid=False, skip_all_hybrid=False, load_profile="full_recalculate"):
+    my_pub = lookup_product(load_profile=load_profile, **biblio)
     if run_with_hybrid:
         my_pub.run_with_hybrid()
         safe_commit(db)
@@ -155,6 +391,9 @@ def get_pub_from_biblio(biblio, run_with_hybrid=False, skip_all_hybrid=False):
         my_pub.recalculate(green_scrape_if_necessary=False)
     return my_pub
 
+def pmc_page_needs_info(my_page):
+    return not my_page.scrape_version and u"/pmc/" in my_page.url
+
 def max_pages_from_one_repo(repo_ids):
     repo_id_counter = Counter(repo_ids)
     most_common = repo_id_counter.most_common(1)
@@ -196,6 +435,10 @@ def csv_dict_from_response_dict(data):
 
     return response
 
+def csv_fieldnames():
+    fieldnames = sorted(csv_dict_from_response_dict({"doi": None}).keys())
+    return ["doi"] + [name for name in fieldnames if name != "doi"]
+
 
 
 def build_crossref_record(data):
@@ -311,14 +554,16 @@ class PmcidLookup(db.Model):
 class Pub(db.Model):
     id = db.Column(db.Text, primary_key=True)
     updated = db.Column(db.DateTime)
-    crossref_api_raw_new = db.Column(JSONB)
+    crossref_api_raw_new = db.deferred(db.Column(JSONB))
     published_date = db.Column(db.DateTime)
     title = db.Column(db.Text)
     normalized_title = db.Column(db.Text)
     issns_jsonb = db.Column(JSONB)
 
     last_changed_date = db.Column(db.DateTime)
-    response_jsonb = db.Column(JSONB)
+    response_jsonb = db.deferred(db.Column(JSONB))
+    # alter table pub add column response_fingerprint text;
+    response_fingerprint = db.Column(db.Text)
     response_is_oa = db.Column(db.Boolean)
     response_best_evidence = db.Column(db.Text)
     response_best_url = db.Column(db.Text)
@@ -347,9 +592,10 @@ class Pub(db.Model):
     #     foreign_keys="Abstract.doi"
     # )
 
+    # the relationships are loaded up front only by the full_recalculate load profile
     pmcid_links = db.relationship(
         'PmcidLookup',
-        lazy='subquery',
+        lazy='select',
         viewonly=True,
         cascade="all, delete-orphan",
         backref=db.backref("pub", lazy="subquery"),
@@ -358,7 +604,7 @@ class Pub(db.Model):
 
     page_matches_by_doi = db.relationship(
         'Page',
-        lazy='subquery',
+        lazy='select',
         cascade="all, delete-orphan",
         viewonly=True,
         enable_typechecks=False,
@@ -368,7 +614,7 @@ class Pub(db.Model):
 
     page_new_matches_by_doi = db.relationship(
         'PageDoiMatch',
-        lazy='subquery',
+        lazy='select',
         cascade="all, delete-orphan",
         viewonly=True,
         enable_typechecks=False,
@@ -378,7 +624,7 @@ class Pub(db.Model):
 
     page_new_matches_by_title = db.relationship(
         'PageTitleMatch',
-        lazy='subquery',
+        lazy='select',
         cascade="all, delete-orphan",
         viewonly=True,
         enable_typechecks=False,
@@ -388,6 +634,7 @@ class Pub(db.Model):
 
     def __init__(self, **biblio):
         self.reset_vars()
+        self.reset_crossref_record_stats()
         self.rand = random.random()
         # self.updated = datetime.datetime.utcnow()
         for (k, v) in biblio.iteritems():
@@ -396,6 +643,7 @@ class Pub(db.Model):
     @orm.reconstructor
     def init_on_load(self):
         self.reset_vars()
+        self.reset_crossref_record_stats()
 
 
     def reset_vars(self):
@@ -409,9 +657,19 @@ class Pub(db.Model):
         self.oa_color = None
         self.evidence = None
         self.open_locations = []
+        self.location_ranking = None
         self.closed_urls = []
         self.session_id = None
         self.version = None
+        self.clear_crossref_record_cache()
+
+    def clear_crossref_record_cache(self):
+        self.crossref_record_cached = False
+        self.crossref_record_cache = None
+
+    def reset_crossref_record_stats(self):
+        self.crossref_record_builds = 0
+        self.crossref_record_rebuilds_avoided = 0
 
     @property
     def doi(self):
@@ -438,6 +696,18 @@ class Pub(db.Model):
 
     @property
     def crossref_api_modified(self):
+        # lots of properties read from this, so only build it once per crossref_api_raw_new
+        if self.crossref_record_cached:
+            self.crossref_record_rebuilds_avoided += 1
+            return self.crossref_record_cache
+
+        record = self.build_crossref_api_modified()
+        self.crossref_record_builds += 1
+        self.crossref_record_cache = record
+        self.crossref_record_cached = True
+        return record
+
+    def build_crossref_api_modified(self):
         record = None
         if self.crossref_api_raw_new:
             try:
@@ -456,15 +726,18 @@ class Pub(db.Model):
 
         return record
 
+    @property
+    def crossref_record_cache_stats(self):
+        return {
+            "builds": self.crossref_record_builds,
+            "rebuilds_avoided": self.crossref_record_rebuilds_avoided
+        }
+
 
     @property
     def open_urls(self):
         # return sorted urls, without dups
-        urls = []
-        for location in self.sorted_locations:
-            if location.best_url not in urls:
-                urls.append(location.best_url)
-        return urls
+        return [location.best_url for location in self.deduped_sorted_locations]
     
     @property
     def url(self):
@@ -521,6 +794,7 @@ class Pub(db.Model):
     def set_results(self):
         self.issns_jsonb = self.issns
         self.response_jsonb = self.to_dict_v2()
+        self.response_fingerprint = get_response_fingerprint(self.response_jsonb)
         self.response_is_oa = self.is_oa
         self.response_best_url = self.best_url
         self.response_best_evidence = self.best_evidence
@@ -530,6 +804,7 @@ class Pub(db.Model):
 
     def clear_results(self):
         self.response_jsonb = None
+        self.response_fingerprint = None
         self.response_is_oa = None
         self.response_best_url = None
         self.response_best_evidence = None
@@ -540,7 +815,7 @@ class Pub(db.Model):
         self.issns_jsonb = None
 
 
-    def has_changed(self, old_response_jsonb):
+    def has_changed(self, old_response_jsonb, old_response_fingerprint=None):
         # for now at least, or else too noisy on all the plos components
         if self.genre == "component":
             return False
@@ -549,35 +824,11 @@ class Pub(db.Model):
             logger.info(u"response for {} has changed: no old response".format(self.id))
             return True
 
-        copy_of_new_response = self.response_jsonb
-        copy_of_old_response = old_response_jsonb
-
-        copy_of_new_response_in_json = json.dumps(copy_of_new_response, sort_keys=True, indent=2)  # have to sort to compare
-        copy_of_old_response_in_json = json.dumps(copy_of_old_response, sort_keys=True, indent=2)  # have to sort to compare
+        # rows from before the fingerprint column get one computed from the stored response
+        if not old_response_fingerprint:
+            old_response_fingerprint = get_response_fingerprint(old_response_jsonb)
 
-        # remove these keys because they may change
-        keys_to_delete = ["updated", "last_changed_date", "x_reported_noncompliant_copies", "x_error", "data_standard"]
-        for key in keys_to_delete:
-            # also remove it if it is an empty list
-            copy_of_new_response_in_json = re.sub(ur'"{}":\s*".+?",?\s*'.format(key), '', copy_of_new_response_in_json)
-            copy_of_old_response_in_json = re.sub(ur'"{}":\s*".+?",?\s*'.format(key), '', copy_of_old_response_in_json)
-
-            # also remove it if it is an empty list
-            copy_of_new_response_in_json = re.sub(ur'"{}":\s*\[\],?\s*'.format(key), '', copy_of_new_response_in_json)
-            copy_of_old_response_in_json = re.sub(ur'"{}":\s*\[\],?\s*'.format(key), '', copy_of_old_response_in_json)
-
-            # also anything till a comma (gets data_standard)
-            copy_of_new_response_in_json = re.sub(ur'"{}":\s*.+?,\s*'.format(key), '', copy_of_new_response_in_json)
-            copy_of_old_response_in_json = re.sub(ur'"{}":\s*.+?,\s*'.format(key), '', copy_of_old_response_in_json)
-
-        if copy_of_new_response_in_json != copy_of_old_response_in_json:
-            # print "copy_of_new_response_in_json, ***"
-            # print copy_of_new_response_in_json
-            # print "copy_of_old_response_in_json, ***"
-            # print copy_of_old_response_in_json
-            return True
-
-        return False
+        return self.response_fingerprint != old_response_fingerprint
 
     def update(self):
         return self.recalculate_and_store()
@@ -595,6 +846,7 @@ class Pub(db.Model):
             self.rand = random.random()
 
         old_response_jsonb = self.response_jsonb
+        old_response_fingerprint = self.response_fingerprint
 
         self.clear_results()
         try:
@@ -606,11 +858,12 @@ class Pub(db.Model):
 
         self.set_results()
 
-        if self.has_changed(old_response_jsonb):
+        if self.has_changed(old_response_jsonb, old_response_fingerprint):
             logger.info(u"changed! updating the pub table for this record! {}".format(self.id))
             self.last_changed_date = datetime.datetime.utcnow().isoformat()
             self.updated = datetime.datetime.utcnow()
             flag_modified(self, "response_jsonb") # force it to be saved
+            response_cache.invalidate(self.id)
         else:
             # logger.info(u"didn't change")
             pass
@@ -721,11 +974,10 @@ class Pub(db.Model):
         self.version = None
         self.evidence = None
 
-        reversed_sorted_locations = self.sorted_locations
-        reversed_sorted_locations.reverse()
+        self.location_ranking = rank_locations(self.open_locations)
 
         # go through all the locations, using valid ones to update the best open url data
-        for location in reversed_sorted_locations:
+        for location in reversed(self.sorted_locations):
             self.free_pdf_url = location.pdf_url
             self.free_metadata_url = location.metadata_url
             self.evidence = location.evidence
@@ -773,21 +1025,10 @@ class Pub(db.Model):
 
 
     def refresh_hybrid_scrape(self):
-        logger.info(u"***** {}: {}".format(self.publisher, self.journal))
-        # look for hybrid
-        self.scrape_updated = datetime.datetime.utcnow().isoformat()
-
-        # reset
-        self.scrape_evidence = None
-        self.scrape_pdf_url = None
-        self.scrape_metadata_url = None
-        self.scrape_license = None
+        publisher_landing_page = self.start_hybrid_scrape()
 
-        if self.url:
-            with PublisherWebpage(url=self.url,
-                                  related_pub_doi=self.doi,
-                                  related_pub_publisher=self.publisher,
-                                  session_id=self.session_id) as publisher_landing_page:
+        if publisher_landing_page:
+            with publisher_landing_page:
 
                 # end the session before the scrape
                 # logger.info(u"closing session for {}".format(self.doi))
@@ -799,15 +1040,38 @@ class Pub(db.Model):
                 # logger.info(u"after scrape, merging {}".format(self.doi))
                 db.session.merge(self)
 
-                if publisher_landing_page.is_open:
-                    self.scrape_evidence = publisher_landing_page.open_version_source_string
-                    self.scrape_pdf_url = publisher_landing_page.scraped_pdf_url
-                    self.scrape_metadata_url = publisher_landing_page.scraped_open_metadata_url
-                    self.scrape_license = publisher_landing_page.scraped_license
-                    if publisher_landing_page.is_open and not publisher_landing_page.scraped_pdf_url:
-                        self.scrape_metadata_url = self.url
+                self.set_hybrid_scrape_results(publisher_landing_page)
         return
 
+    # split out so the scrape itself can run in refresh_pubs_concurrently
+    def start_hybrid_scrape(self):
+        logger.info(u"***** {}: {}".format(self.publisher, self.journal))
+        # look for hybrid
+        self.scrape_updated = datetime.datetime.utcnow().isoformat()
+
+        # reset
+        self.scrape_evidence = None
+        self.scrape_pdf_url = None
+        self.scrape_metadata_url = None
+        self.scrape_license = None
+
+        if not self.url:
+            return None
+
+        return PublisherWebpage(url=self.url,
+                                related_pub_doi=self.doi,
+                                related_pub_publisher=self.publisher,
+                                session_id=self.session_id)
+
+    def set_hybrid_scrape_results(self, publisher_landing_page):
+        if publisher_landing_page.is_open:
+            self.scrape_evidence = publisher_landing_page.open_version_source_string
+            self.scrape_pdf_url = publisher_landing_page.scraped_pdf_url
+            self.scrape_metadata_url = publisher_landing_page.scraped_open_metadata_url
+            self.scrape_license = publisher_landing_page.scraped_license
+            if publisher_landing_page.is_open and not publisher_landing_page.scraped_pdf_url:
+                self.scrape_metadata_url = self.url
+
 
     def find_open_locations(self, green_scrape_if_necessary=True):
 
@@ -897,19 +1161,26 @@ class Pub(db.Model):
 
             self.open_locations.append(my_location)
 
+    @property
+    def pmcid_lookups(self):
+        # (pmcid, release_date, version) tuples
+        if pmcid_index:
+            return pmcid_index.get(self.doi)
+        return [(pmc_obj.pmcid, pmc_obj.release_date, pmc_obj.version) for pmc_obj in self.pmcid_links]
+
     def ask_pmc(self):
         total_start_time = time()
 
-        for pmc_obj in self.pmcid_links:
-            if pmc_obj.release_date == "live":
+        for (pmcid, release_date, version) in self.pmcid_lookups:
+            if release_date == "live":
                 my_location = OpenLocation()
-                my_location.metadata_url = "https://www.ncbi.nlm.nih.gov/pmc/articles/{}".format(pmc_obj.pmcid.upper())
+                my_location.metadata_url = "https://www.ncbi.nlm.nih.gov/pmc/articles/{}".format(pmcid.upper())
                 # we don't know this has a pdf version
                 # my_location.pdf_url = "https://www.ncbi.nlm.nih.gov/pmc/articles/{}/pdf".format(pmc_obj.pmcid.upper())
                 my_location.evidence = "oa repository (via pmcid lookup)"
                 my_location.updated = datetime.datetime.utcnow()
                 my_location.doi = self.doi
-                my_location.version = pmc_obj.version
+                my_location.version = version
                 # set version in one central place for pmc right now, till refactor done
                 self.open_locations.append(my_location)
 
@@ -986,10 +1257,19 @@ class Pub(db.Model):
                 my_pages = self.page_matches_by_title_filtered
 
         # do dois last, because the objects are actually the same, not copies, and then they get the doi reason
-        for my_page in self.page_matches_by_doi_filtered:
+        # pmc info comes from the local pmc_info table, with one batched europe pmc query for
+        # anything it doesn't have.  update_pubs_in_batch asks for the whole chunk up front.
+        doi_pages = self.page_matches_by_doi_filtered
+        pmc_pages = [my_page for my_page in doi_pages if pmc_page_needs_info(my_page)]
+        pmc_page_urls = set([my_page.url for my_page in pmc_pages])
+        pmc_infos = {}
+        if pmc_pages:
+            pmc_infos = get_pmc_info([my_page.pmcid for my_page in pmc_pages])
+
+        for my_page in doi_pages:
             my_page.match_evidence = u"oa repository (via OAI-PMH doi match)"
-            if not my_page.scrape_version and u"/pmc/" in my_page.url:
-                my_page.set_info_for_pmc_page()
+            if my_page.url in pmc_page_urls and my_page.pmcid in pmc_infos:
+                set_page_info_from_pmc_info(my_page, pmc_infos[my_page.pmcid])
 
             my_pages.append(my_page)
 
@@ -1036,40 +1316,24 @@ class Pub(db.Model):
 
 
     def scrape_page_for_open_location(self, my_webpage):
-        # logger.info(u"scraping", url)
-        try:
-            my_webpage.scrape_for_fulltext_link()
+        scrape_error = scrape_webpage_for_open_location(my_webpage)
+        self.add_scraped_open_location(my_webpage, scrape_error)
 
-            if my_webpage.error:
-                self.error += my_webpage.error
+    def add_scraped_open_location(self, my_webpage, scrape_error):
+        if scrape_error:
+            self.error += scrape_error
+            return
 
-            if my_webpage.is_open:
-                my_open_location = my_webpage.mint_open_location()
-                self.open_locations.append(my_open_location)
-                # logger.info(u"found open version at", webpage.url)
-            else:
-                # logger.info(u"didn't find open version at", webpage.url)
-                pass
+        if my_webpage.error:
+            self.error += my_webpage.error
 
-        except requests.Timeout, e:
-            self.error += "Timeout in scrape_page_for_open_location on {}: {}".format(my_webpage, unicode(e.message).encode("utf-8"))
-            logger.info(self.error)
-        except requests.exceptions.ConnectionError, e:
-            self.error += "ConnectionError in scrape_page_for_open_location on {}: {}".format(my_webpage, unicode(e.message).encode("utf-8"))
-            logger.info(self.error)
-        except requests.exceptions.ChunkedEncodingError, e:
-            self.error += "ChunkedEncodingError in scrape_page_for_open_location on {}: {}".format(my_webpage, unicode(e.message).encode("utf-8"))
-            logger.info(self.error)
-        except requests.exceptions.RequestException, e:
-            self.error += "RequestException in scrape_page_for_open_location on {}: {}".format(my_webpage, unicode(e.message).encode("utf-8"))
-            logger.info(self.error)
-        except etree.XMLSyntaxError, e:
-            self.error += "XMLSyntaxError in scrape_page_for_open_location on {}: {}".format(my_webpage, unicode(e.message).encode("utf-8"))
-            logger.info(self.error)
-        except Exception, e:
-            logger.exception(u"Exception in scrape_page_for_open_location")
-            self.error += "Exception in scrape_page_for_open_location"
-            logger.info(self.error)
+        if my_webpage.is_open:
+            my_open_location = my_webpage.mint_open_location()
+            self.open_locations.append(my_open_location)
+            # logger.info(u"found open version at", webpage.url)
+        else:
+            # logger.info(u"didn't find open version at", webpage.url)
+            pass
 
 
     def set_title_hacks(self):
@@ -1300,26 +1564,19 @@ class Pub(db.Model):
         except (AttributeError, TypeError, KeyError):
             return None
 
+    def get_location_ranking(self):
+        # decide_if_open ranks them, but rank here too if something reads them before that ran
+        if self.location_ranking is None:
+            self.location_ranking = rank_locations(self.open_locations)
+        return self.location_ranking
+
     @property
     def deduped_sorted_locations(self):
-        locations = []
-        for next_location in self.sorted_locations:
-            urls_so_far = [location.best_url for location in locations]
-            if next_location.best_url not in urls_so_far:
-                locations.append(next_location)
-        return locations
+        return self.get_location_ranking().deduped_locations
 
     @property
     def sorted_locations(self):
-        locations = self.open_locations
-        # first sort by best_url so ties are handled consistently
-        locations = sorted(locations, key=lambda x: x.best_url, reverse=False)
-        # now sort by what's actually better
-        locations = sorted(locations, key=lambda x: x.sort_score, reverse=False)
-
-        # now remove noncompliant ones
-        locations = [location for location in locations if not location.is_reported_noncompliant]
-        return locations
+        return self.get_location_ranking().sorted_locations
 
     @property
     def data_standard(self):
@@ -1417,19 +1674,15 @@ class Pub(db.Model):
 
     @property
     def best_oa_location(self):
-        all_locations = [location for location in self.all_oa_locations]
+        all_locations = self.deduped_sorted_locations
         if all_locations:
             return all_locations[0]
         return None
 
     @property
     def all_oa_locations(self):
-        all_locations = [location for location in self.deduped_sorted_locations]
-        if all_locations:
-            for location in all_locations:
-                location.is_best = False
-            all_locations[0].is_best = True
-        return all_locations
+        # is_best is set when they're ranked
+        return list(self.deduped_sorted_locations)
 
     def all_oa_location_dicts(self):
         return [location.to_dict_v2() for location in self.all_oa_locations]
@@ -1631,6 +1884,13 @@ class Pub(db.Model):
 
 
 
+# the parsed crossref record is cached on the instance, so throw it away
+# whenever the raw crossref data is reassigned (like in refresh_crossref)
+@event.listens_for(Pub.crossref_api_raw_new, "set")
+def clear_crossref_record_cache_on_set(target, value, oldvalue, initiator):
+    target.clear_crossref_record_cache()
+
+
 # db.create_all()
 # commit_success = safe_commit(db)
 # if not commit_success:
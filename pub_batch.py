@@ -0,0 +1,132 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import json
+from collections import defaultdict
+from time import time
+
+from psycopg2.extras import execute_values
+from sqlalchemy import orm
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app import db
+from app import logger
+from page import Page
+from page import PageDoiMatch
+from page import PageTitleMatch
+from oa_pmc import get_pmc_info
+from pmcid_index import pmcid_index
+from pub import Pub
+from pub import PmcidLookup
+from pub import pmc_page_needs_info
+from util import chunks
+from util import elapsed
+
+
+# what recalculate_and_store can change, written back for the whole chunk in one statement
+BATCH_UPDATE_COLUMNS = [
+    "title",
+    "normalized_title",
+    "published_date",
+    "rand",
+    "issns_jsonb",
+    "response_jsonb",
+    "response_fingerprint",
+    "response_is_oa",
+    "response_best_evidence",
+    "response_best_url",
+    "response_best_host",
+    "response_best_repo_id",
+    "response_best_version",
+    "error",
+    "last_changed_date",
+    "updated"
+]
+
+
+def group_rows(query, key_column, keys, key_fn):
+    # one query per 1000 keys instead of one per pub
+    rows_by_key = defaultdict(list)
+    for key_chunk in chunks(keys, 1000):
+        for row in query.filter(key_column.in_(key_chunk)):
+            rows_by_key[key_fn(row)].append(row)
+    return rows_by_key
+
+
+def load_related_rows(pubs):
+    # fill in the relationships find_open_locations reads, so none of them lazy load per pub.
+    # the backrefs to pub are left lazy: we already have the pubs.
+    start_time = time()
+    dois = list(set([my_pub.id for my_pub in pubs]))
+    titles = list(set([my_pub.normalized_title for my_pub in pubs if my_pub.normalized_title]))
+
+    pages_by_doi = group_rows(
+        db.session.query(Page).options(orm.lazyload("pub_by_doi")), Page.doi, dois, lambda row: row.doi)
+    page_new_by_doi = group_rows(
+        db.session.query(PageDoiMatch).options(orm.lazyload("pub")), PageDoiMatch.doi, dois, lambda row: row.doi)
+    page_new_by_title = group_rows(
+        db.session.query(PageTitleMatch).options(orm.lazyload("pub")), PageTitleMatch.normalized_title, titles, lambda row: row.normalized_title)
+    pmcid_links_by_doi = {}
+    if not pmcid_index:
+        pmcid_links_by_doi = group_rows(
+            db.session.query(PmcidLookup).options(orm.lazyload("pub")), PmcidLookup.doi, dois, lambda row: row.doi)
+
+    for my_pub in pubs:
+        set_committed_value(my_pub, "page_matches_by_doi", pages_by_doi.get(my_pub.id, []))
+        set_committed_value(my_pub, "page_new_matches_by_doi", page_new_by_doi.get(my_pub.id, []))
+        set_committed_value(my_pub, "page_new_matches_by_title", page_new_by_title.get(my_pub.normalized_title, []))
+        if not pmcid_index:
+            set_committed_value(my_pub, "pmcid_links", pmcid_links_by_doi.get(my_pub.id, []))
+
+    # one batched europe pmc query for the chunk's doi-matched pmc pages, so Pub.pages finds them locally
+    get_pmc_info([my_page.pmcid for my_pub in pubs
+                  for my_page in my_pub.page_matches_by_doi_filtered if pmc_page_needs_info(my_page)])
+
+    logger.info(u"loaded related rows for {} pubs in {} seconds".format(len(pubs), elapsed(start_time, 2)))
+
+
+def column_value(my_pub, column_name):
+    value = getattr(my_pub, column_name)
+    if value is not None and column_name.endswith("_jsonb"):
+        value = json.dumps(value)
+    return value
+
+
+def write_pub_results(pubs):
+    # one update ... from (values ...) for every changed pub, instead of one update each at commit
+    changed_pubs = [my_pub for my_pub in pubs if db.session.is_modified(my_pub)]
+    if not changed_pubs:
+        return 0
+
+    column_types = [Pub.__table__.c[column_name].type.compile(dialect=db.engine.dialect) for column_name in BATCH_UPDATE_COLUMNS]
+    template = u"({})".format(u", ".join([u"%s"] + [u"%s::{}".format(column_type) for column_type in column_types]))
+    sql = u"update pub set {set_columns} from (values %s) as v (id, {columns}) where pub.id = v.id".format(
+        set_columns=u", ".join([u"{0}=v.{0}".format(column_name) for column_name in BATCH_UPDATE_COLUMNS]),
+        columns=u", ".join(BATCH_UPDATE_COLUMNS)
+    )
+    rows = [[my_pub.id] + [column_value(my_pub, column_name) for column_name in BATCH_UPDATE_COLUMNS] for my_pub in changed_pubs]
+
+    # the session's own connection, so this is part of the same transaction as the commit
+    cursor = db.session.connection().connection.cursor()
+    execute_values(cursor, sql, rows, template=template, page_size=len(rows))
+
+    # they're written, so don't let the flush write them again
+    for my_pub in changed_pubs:
+        db.session.expire(my_pub, BATCH_UPDATE_COLUMNS)
+    return len(changed_pubs)
+
+
+def update_pubs_in_batch(pubs):
+    # same as calling update() on each pub, but with the related rows loaded for the whole
+    # chunk up front and the results written back in one statement
+    load_related_rows(pubs)
+
+    start_time = time()
+    with db.session.no_autoflush:
+        for my_pub in pubs:
+            my_pub.update()
+    logger.info(u"recalculated {} pubs in {} seconds".format(len(pubs), elapsed(start_time, 2)))
+
+    start_time = time()
+    num_changed = write_pub_results(pubs)
+    logger.info(u"wrote {} changed pubs in {} seconds".format(num_changed, elapsed(start_time, 2)))
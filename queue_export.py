@@ -0,0 +1,93 @@
+import argparse
+from time import time
+from time import sleep
+from sqlalchemy import text
+
+from app import db
+from app import logger
+
+from queue_main import DbQueue
+from export_job import ExportJob
+
+
+class DbQueueExport(DbQueue):
+
+    def table_name(self, job_type):
+        table_name = "export_job"
+        return table_name
+
+    def process_name(self, job_type):
+        process_name = "run_export" # formation name is from Procfile
+        return process_name
+
+
+    def worker_run(self, **kwargs):
+        single_obj_id = kwargs.get("id", None)
+        chunk = kwargs.get("chunk")
+        queue_table = "export_job"
+        run_method = kwargs.get("method")
+        run_class = ExportJob
+
+        if not single_obj_id:
+            text_query_pattern = """WITH picked_from_queue AS (
+                   SELECT *
+                   FROM   {queue_table}
+                   WHERE  started is null
+                   ORDER BY created asc
+               LIMIT  {chunk}
+               FOR UPDATE SKIP LOCKED
+               )
+            UPDATE {queue_table} rows_to_update
+            SET    started=now()
+            FROM   picked_from_queue
+            WHERE picked_from_queue.id = rows_to_update.id
+            RETURNING picked_from_queue.*;"""
+
+        loop_count = 0
+        start_time = time()
+        while True:
+            new_loop_start_time = time()
+            if single_obj_id:
+                objects = [run_class.query.get(single_obj_id)]
+            else:
+                text_query = text_query_pattern.format(
+                    chunk=chunk,
+                    queue_table=queue_table
+                )
+                objects = run_class.query.from_statement(text(text_query)).execution_options(autocommit=True).all()
+
+            if not objects:
+                sleep(5)
+                continue
+
+            self.update_fn(run_class, run_method, objects, index=loop_count)
+
+            # finished is set in update_fn
+            loop_count += 1
+            if single_obj_id:
+                return
+            else:
+                self.print_update(new_loop_start_time, chunk, chunk, start_time, loop_count)
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run stuff.")
+    parser.add_argument('--id', nargs="?", type=str, help="id of the one thing you want to update (case sensitive)")
+    parser.add_argument('--doi', nargs="?", type=str, help="not used, here so run_right_thing works")
+    parser.add_argument('--method', nargs="?", type=str, default="run", help="method name to run")
+
+    parser.add_argument('--reset', default=False, action='store_true', help="do you want to just reset?")
+    parser.add_argument('--run', default=False, action='store_true', help="to run the queue")
+    parser.add_argument('--status', default=False, action='store_true', help="to logger.info(the status")
+    parser.add_argument('--dynos', default=None, type=int, help="scale to this many dynos")
+    parser.add_argument('--logs', default=False, action='store_true', help="logger.info(out logs")
+    parser.add_argument('--monitor', default=False, action='store_true', help="monitor till done, then turn off dynos")
+    parser.add_argument('--kick', default=False, action='store_true', help="put started but unfinished jobs back to unstarted so they are retried")
+    parser.add_argument('--chunk', "-ch", nargs="?", default=1, type=int, help="how many to take off db at once")
+
+    parsed_args = parser.parse_args()
+
+    job_type = "normal"  #should be an object attribute
+    my_queue = DbQueueExport()
+    my_queue.run_right_thing(parsed_args, job_type)
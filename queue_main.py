@@ -207,6 +207,42 @@ class DbQueue(object):
         return None  # important for if we use this on RQ
 
 
+    # like update_fn, but hands the whole chunk to run_concurrently, eg scrape_pages_concurrently
+    def update_fn_concurrent(self, cls, method_name, objects, run_concurrently, index=1):
+        db.engine.dispose()
+
+        objects = [obj for obj in objects if obj is not None]
+        start_time = time()
+        logger.info(u"*** #{count} starting {num} {repr}.{method_name}() concurrently".format(
+            count=len(objects)*index,
+            num=len(objects),
+            repr=cls.__name__,
+            method_name=method_name
+        ))
+
+        run_concurrently(objects)
+
+        logger.info(u"finished {num} {repr}.{method_name}(). took {elapsed} seconds".format(
+            num=len(objects),
+            repr=cls.__name__,
+            method_name=method_name,
+            elapsed=elapsed(start_time, 4)
+        ))
+
+        for obj in objects:
+            # for handling the queue
+            if not (method_name == "update" and obj.__class__.__name__ == "Pub"):
+                obj.finished = datetime.datetime.utcnow().isoformat()
+
+        start_time = time()
+        commit_success = safe_commit(db)
+        if not commit_success:
+            logger.info(u"COMMIT fail")
+        logger.info(u"commit took {} seconds".format(elapsed(start_time, 2)))
+        db.session.remove()  # close connection nicely
+        return None
+
+
     def run(self, parsed_args, job_type):
         start = time()
 
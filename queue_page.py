@@ -21,6 +21,9 @@ from util import elapsed
 from util import safe_commit
 from pub import Pub
 from page import PageNew
+from page import scrape_pages_concurrently
+from scrape_engine import ScrapeEngine
+from oa_pdf import pdf_text_extractor
 
 
 class DbQueueRepo(DbQueue):
@@ -41,6 +44,7 @@ class DbQueueRepo(DbQueue):
         run_method = kwargs.get("method")
         run_class = PageNew
         noloop = kwargs.get("noloop")
+        concurrency = kwargs.get("concurrency")
 
         if not single_obj_id:
             text_query_pattern = """WITH picked_from_queue AS (
@@ -83,7 +87,14 @@ class DbQueueRepo(DbQueue):
                 continue
 
             object_ids = [obj.id for obj in objects]
-            self.update_fn(run_class, run_method, objects, index=loop_count)
+            if concurrency and run_method == "scrape_if_matches_pub":
+                engine = ScrapeEngine(max_in_flight=concurrency)
+                self.update_fn_concurrent(run_class, run_method, objects,
+                                          lambda pages: scrape_pages_concurrently(pages, engine),
+                                          index=loop_count)
+            else:
+                self.update_fn(run_class, run_method, objects, index=loop_count)
+            logger.info(u"pdf text extraction stats so far: {}".format(pdf_text_extractor.stats))
 
             # finished is set in update_fn
             loop_count += 1
@@ -135,6 +146,7 @@ if __name__ == "__main__":
     parser.add_argument('--kick', default=False, action='store_true', help="put started but unfinished dois back to unstarted so they are retried")
     parser.add_argument('--limit', "-l", nargs="?", type=int, help="how many jobs to do")
     parser.add_argument('--chunk', "-ch", nargs="?", default=3, type=int, help="how many to take off db at once")
+    parser.add_argument('--concurrency', nargs="?", default=None, type=int, help="scrape this many pages at once with the scrape engine")
 
     parsed_args = parser.parse_args()
 
@@ -4,13 +4,16 @@ import random
 from time import time
 from time import sleep
 from sqlalchemy import text
-from sqlalchemy import orm
 
 from app import db
 from app import logger
 
 from queue_main import DbQueue
 from pub import Pub
+from pub import query_pubs
+from pub import refresh_pubs_concurrently
+from pub_batch import update_pubs_in_batch
+from scrape_engine import ScrapeEngine
 from util import run_sql
 from util import elapsed
 from util import clean_doi
@@ -33,6 +36,8 @@ class DbQueuePub(DbQueue):
         limit = kwargs.get("limit", 10)
         run_class = Pub
         run_method = kwargs.get("method")
+        concurrency = kwargs.get("concurrency")
+        batch = kwargs.get("batch")
 
         if single_obj_id:
             limit = 1
@@ -91,7 +96,7 @@ class DbQueuePub(DbQueue):
             new_loop_start_time = time()
             if single_obj_id:
                 single_obj_id = clean_doi(single_obj_id)
-                objects = [run_class.query.filter(run_class.id == single_obj_id).first()]
+                objects = [query_pubs("full_recalculate").filter(Pub.id == single_obj_id).first()]
             else:
                 logger.info(u"looking for new jobs")
 
@@ -101,7 +106,8 @@ class DbQueuePub(DbQueue):
                 logger.info(u"got ids, took {} seconds".format(elapsed(job_time)))
 
                 job_time = time()
-                q = db.session.query(Pub).options(orm.undefer('*')).filter(Pub.id.in_(object_ids))
+                load_profile = "batch_recalculate" if batch and run_method == "update" else "full_recalculate"
+                q = query_pubs(load_profile).filter(Pub.id.in_(object_ids))
                 objects = q.all()
                 logger.info(u"got pub objects in {} seconds".format(elapsed(job_time)))
 
@@ -126,7 +132,15 @@ class DbQueuePub(DbQueue):
                 continue
 
             object_ids = [obj.id for obj in objects]
-            self.update_fn(run_class, run_method, objects, index=index)
+            if concurrency and run_method == "refresh":
+                engine = ScrapeEngine(max_in_flight=concurrency)
+                self.update_fn_concurrent(run_class, run_method, objects,
+                                          lambda pubs: refresh_pubs_concurrently(pubs, engine),
+                                          index=index)
+            elif batch and run_method == "update" and not single_obj_id:
+                self.update_fn_concurrent(run_class, run_method, objects, update_pubs_in_batch, index=index)
+            else:
+                self.update_fn(run_class, run_method, objects, index=index)
 
             # logger.info(u"finished update_fn")
             if queue_table:
@@ -164,6 +178,8 @@ if __name__ == "__main__":
     parser.add_argument('--kick', default=False, action='store_true', help="put started but unfinished dois back to unstarted so they are retried")
     parser.add_argument('--limit', "-l", nargs="?", type=int, help="how many jobs to do")
     parser.add_argument('--chunk', "-ch", nargs="?", default=500, type=int, help="how many to take off db at once")
+    parser.add_argument('--concurrency', nargs="?", default=None, type=int, help="with --method=refresh, scrape this many pubs at once with the scrape engine")
+    parser.add_argument('--batch', default=False, action='store_true', help="with --method=update, load related rows and write results for the whole chunk at once")
 
     parsed_args = parser.parse_args()
 
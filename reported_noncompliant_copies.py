@@ -1,5 +1,14 @@
+import os
+import json
+
+from multi_matcher import MultiMatcher
 from util import clean_doi
 
+
+# a json file of {doi: [url fragment, ...]}, added to the ones below.  for when the list
+# outgrows this file.
+REPORTED_NONCOMPLIANT_COPIES_FILE = os.getenv("REPORTED_NONCOMPLIANT_COPIES_FILE", None)
+
 lookup_raw = {
     "10.1016/j.biocon.2016.04.014": [
         "researchgate.net/profile/Arthur_Muneza/publication/301936941_Regional_variation_of_the_manifestation_prevalence_and_severity_of_giraffe_skin_disease_A_review_of_an_emerging_disease_in_wild_and_captive_giraffe_populations/links/57449ff608ae9ace8421a52f.pdf"
@@ -16,23 +25,53 @@ lookup_raw = {
 }
 
 
+def load_lookup_raw():
+    if not REPORTED_NONCOMPLIANT_COPIES_FILE:
+        return lookup_raw
+    all_lookup_raw = dict(lookup_raw)
+    with open(REPORTED_NONCOMPLIANT_COPIES_FILE, "r") as fh:
+        for (doi_key, fragment_list) in json.load(fh).iteritems():
+            all_lookup_raw[doi_key] = all_lookup_raw.get(doi_key, []) + fragment_list
+    return all_lookup_raw
+
+
+def build_lookup(raw):
+    # clean doi -> (lowercased fragments, a matcher over them), built once at import
+    lookup = {}
+    for (doi_key, fragment_list) in raw.iteritems():
+        my_doi = clean_doi(doi_key)
+        fragments = lookup.get(my_doi, ([], None))[0] + [fragment.lower() for fragment in fragment_list]
+        lookup[my_doi] = (fragments, MultiMatcher(fragments))
+    return lookup
+
+
+lookup_normalized = build_lookup(load_lookup_raw())
+
+
+def noncompliant_matcher_for_doi(dirty_doi):
+    if not dirty_doi:
+        return None
+    entry = lookup_normalized.get(clean_doi(dirty_doi, return_none_if_error=True), None)
+    if entry:
+        return entry[1]
+    return None
+
+
 def is_reported_noncompliant_url(dirty_doi, dirty_url):
     if not dirty_url:
         return False
 
-    my_url = dirty_url.lower()
-    for url_fragment in reported_noncompliant_url_fragments(dirty_doi):
-        if url_fragment in my_url:
-            return True
-    return False
+    matcher = noncompliant_matcher_for_doi(dirty_doi)
+    if not matcher:
+        return False
+    return matcher.matches(dirty_url.lower())
 
 
 def reported_noncompliant_url_fragments(dirty_doi):
     if not dirty_doi:
         return []
 
-    lookup_normalized = {}
-    for (doi_key, fragment_list) in lookup_raw.iteritems():
-        lookup_normalized[clean_doi(doi_key)] = [noncompliant_url_fragment.lower() for noncompliant_url_fragment in fragment_list]
-
-    return lookup_normalized.get(clean_doi(dirty_doi), [])
+    entry = lookup_normalized.get(clean_doi(dirty_doi, return_none_if_error=True), None)
+    if entry:
+        return list(entry[0])
+    return []
@@ -465,13 +465,36 @@ class Endpoint(db.Model):
 
     def get_open_pages(self, limit=10):
         from page import PageNew
-        pages = db.session.query(PageNew).\
+        from pub import Pub
+        from pub import query_pubs
+        # just the columns we show, so the matching pubs don't get loaded with the pages
+        rows = db.session.query(PageNew.id, PageNew.url, PageNew.normalized_title, PageNew.doi, PageNew.match_type, PageNew.scrape_version).\
             distinct(PageNew.normalized_title).\
             filter(PageNew.repo_id==self.id).\
             filter(PageNew.num_pub_matches != None, PageNew.num_pub_matches >= 1).\
             filter(or_(PageNew.scrape_pdf_url != None, PageNew.scrape_metadata_url != None)).\
             limit(limit).all()
-        return [(p.id, p.url, p.normalized_title, p.pub.url, p.pub.unpaywall_api_url, p.scrape_version) for p in pages]
+
+        # the urls only need the pub's id
+        titles = [row.normalized_title for row in rows if row.match_type == "title"]
+        pubs_by_title = {}
+        if titles:
+            for (my_pub, normalized_title) in query_pubs("id_only").add_columns(Pub.normalized_title).filter(Pub.normalized_title.in_(titles)):
+                pubs_by_title[normalized_title] = my_pub
+        dois = [row.doi for row in rows if row.match_type != "title"]
+        pubs_by_doi = {}
+        if dois:
+            pubs_by_doi = dict((my_pub.id, my_pub) for my_pub in query_pubs("id_only").filter(Pub.id.in_(dois)))
+
+        response = []
+        for row in rows:
+            if row.match_type == "title":
+                my_pub = pubs_by_title.get(row.normalized_title, None)
+            else:
+                my_pub = pubs_by_doi.get(row.doi, None)
+            if my_pub:
+                response.append((row.id, row.url, row.normalized_title, my_pub.url, my_pub.unpaywall_api_url, row.scrape_version))
+        return response
 
     def get_closed_pages(self, limit=10):
         from page import PageNew
@@ -0,0 +1,163 @@
+import os
+import json
+import hashlib
+import tempfile
+from collections import OrderedDict
+from threading import Lock
+from time import time
+
+from app import logger
+
+
+RESPONSE_CACHE_MAX_ITEMS = int(os.getenv("RESPONSE_CACHE_MAX_ITEMS", 10000))
+RESPONSE_CACHE_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", 60*60))
+
+# set this to a local directory to share cached responses between gunicorn workers
+RESPONSE_CACHE_DIR = os.getenv("RESPONSE_CACHE_DIR", None)
+
+RESPONSE_VERSIONS = ["v1", "v2"]
+
+
+class LruCache(object):
+    def __init__(self, max_items, ttl_seconds):
+        self.max_items = max_items
+        self.ttl_seconds = ttl_seconds
+        self.items = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.items:
+                return None
+            (stored_time, value) = self.items.pop(key)
+            if time() - stored_time > self.ttl_seconds:
+                return None
+            # put it back at the end, so it is the most recently used
+            self.items[key] = (stored_time, value)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.items.pop(key, None)
+            self.items[key] = (time(), value)
+            while len(self.items) > self.max_items:
+                self.items.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.items.pop(key, None)
+
+    def __len__(self):
+        return len(self.items)
+
+
+class DiskCache(object):
+    def __init__(self, directory, ttl_seconds):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+
+    def path(self, key):
+        key_hash = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        # shard so one directory doesn't get millions of files
+        return os.path.join(self.directory, key_hash[0:2], key_hash)
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            if time() - os.path.getmtime(path) > self.ttl_seconds:
+                return None
+            with open(path, "r") as fh:
+                return json.load(fh)
+        except (OSError, IOError, ValueError):
+            return None
+
+    def set(self, key, value):
+        path = self.path(key)
+        shard_dir = os.path.dirname(path)
+        try:
+            if not os.path.isdir(shard_dir):
+                os.makedirs(shard_dir)
+            # write then rename, so other workers never read a half-written file
+            (fd, temp_path) = tempfile.mkstemp(dir=shard_dir)
+            with os.fdopen(fd, "w") as fh:
+                json.dump(value, fh)
+            os.rename(temp_path, path)
+        except (OSError, IOError):
+            logger.exception(u"couldn't write {} to the shared response cache".format(key))
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except OSError:
+            pass
+
+
+class ResponseCache(object):
+    def __init__(self, max_items, ttl_seconds, shared_dir=None):
+        self.memory = LruCache(max_items, ttl_seconds)
+        self.shared = None
+        if shared_dir:
+            self.shared = DiskCache(shared_dir, ttl_seconds)
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    def key(self, version, doi):
+        return u"{}:{}".format(version, doi)
+
+    # entries are stored with the validator the caller had when it made the response (see
+    # pub.get_response_cache_validator), and only served if the caller's current one matches.
+    # pubs are recalculated by other dynos, so invalidate() alone can't keep every process fresh.
+    def get(self, version, doi, validator):
+        if validator is None:
+            return None
+        key = self.key(version, doi)
+        entry = self.memory.get(key)
+        if entry is not None and entry["validator"] == validator:
+            self.hits += 1
+            return entry["response"]
+
+        if self.shared:
+            entry = self.shared.get(key)
+            if entry is not None and entry.get("validator") == validator:
+                self.shared_hits += 1
+                self.memory.set(key, entry)
+                return entry["response"]
+
+        self.misses += 1
+        return None
+
+    def set(self, version, doi, response, validator):
+        if validator is None:
+            return
+        key = self.key(version, doi)
+        entry = {"validator": validator, "response": response}
+        self.memory.set(key, entry)
+        if self.shared:
+            self.shared.set(key, entry)
+
+    # frees this process's copies early.  other processes find out from the validator.
+    def invalidate(self, doi):
+        for version in RESPONSE_VERSIONS:
+            key = self.key(version, doi)
+            self.memory.delete(key)
+            if self.shared:
+                self.shared.delete(key)
+
+    @property
+    def stats(self):
+        num_requests = self.hits + self.shared_hits + self.misses
+        hit_ratio = None
+        if num_requests:
+            hit_ratio = round(float(self.hits + self.shared_hits) / num_requests, 3)
+        return {
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "hit_ratio": hit_ratio,
+            "items_in_memory": len(self.memory),
+            "shared": self.shared is not None
+        }
+
+
+response_cache = ResponseCache(RESPONSE_CACHE_MAX_ITEMS, RESPONSE_CACHE_TTL_SECONDS, RESPONSE_CACHE_DIR)
@@ -0,0 +1,188 @@
+import os
+from collections import defaultdict
+from threading import Thread
+from threading import Condition
+from time import time
+
+from app import logger
+from util import elapsed
+from host_scheduler import host_scheduler
+from host_scheduler import host_for_url
+from page_rules import page_rule_stats
+
+
+# how many scrapes are waiting on the network at once in this process
+SCRAPE_MAX_IN_FLIGHT = int(os.getenv("SCRAPE_MAX_IN_FLIGHT", 100))
+
+# so we don't hammer one publisher or repository with a whole chunk at once.
+# hosts the host scheduler doesn't rate limit (eg the doi.org resolver) don't count.
+SCRAPE_MAX_PER_HOST = int(os.getenv("SCRAPE_MAX_PER_HOST", 2))
+
+# each job gives up this long after it starts
+SCRAPE_JOB_TIMEOUT_SECONDS = int(os.getenv("SCRAPE_JOB_TIMEOUT_SECONDS", 60*2))
+
+# and the whole run after this, so jobs stuck behind a backed-off host can't hold up a chunk forever
+SCRAPE_RUN_TIMEOUT_SECONDS = int(os.getenv("SCRAPE_RUN_TIMEOUT_SECONDS", 60*30))
+
+
+def scrape_host_for_url(url):
+    host = host_for_url(url)
+    if host_scheduler.is_rate_limited(host):
+        return host
+    return None
+
+
+class ScrapeJob(object):
+    def __init__(self, url, fn):
+        self.url = url
+        self.fn = fn
+        self.host = scrape_host_for_url(url)
+        self.started = None
+        self.finished = None
+        self.timed_out = False
+        self.error = None
+        self.result = None
+
+    @property
+    def succeeded(self):
+        return self.finished is not None and not self.timed_out and self.error is None
+
+    def __repr__(self):
+        return u"<ScrapeJob ( {} )>".format(self.url)
+
+
+class ScrapeRun(object):
+    # the state for one ScrapeEngine.run.  workers only touch the run they were started for,
+    # so a thread abandoned by an earlier run can't change the counts for a later one.
+    def __init__(self, jobs, deadline):
+        self.condition = Condition()
+        self.waiting = list(jobs)
+        self.running = []
+        self.in_flight_per_host = defaultdict(int)
+        self.deadline = deadline
+        self.num_threads = 0
+
+
+class ScrapeEngine(object):
+    """
+    Runs blocking scrape calls (usually Webpage.scrape_for_fulltext_link) on a pool of
+    threads, so a worker has lots of landing pages in flight instead of one.
+    Jobs should only change objects nobody else is using, and return what the caller
+    needs: callers apply job.result for jobs that succeeded, on their own thread.
+    Timed-out jobs are abandoned, not killed, and keep running in the background.
+    """
+    def __init__(self, max_in_flight=SCRAPE_MAX_IN_FLIGHT, max_per_host=SCRAPE_MAX_PER_HOST,
+                 job_timeout_seconds=SCRAPE_JOB_TIMEOUT_SECONDS, run_timeout_seconds=SCRAPE_RUN_TIMEOUT_SECONDS):
+        self.max_in_flight = max_in_flight
+        self.max_per_host = max_per_host
+        self.job_timeout_seconds = job_timeout_seconds
+        self.run_timeout_seconds = run_timeout_seconds
+
+    def run(self, jobs):
+        if not jobs:
+            return jobs
+
+        start_time = time()
+        run = ScrapeRun(jobs, start_time + self.run_timeout_seconds)
+
+        with run.condition:
+            for i in range(min(self.max_in_flight, len(jobs))):
+                self.start_worker(run)
+
+            while not all([job.finished or job.timed_out for job in jobs]):
+                now = time()
+                if now >= run.deadline:
+                    break
+
+                # time out jobs that have run too long.  their threads can't be stopped, so free
+                # up their host and start another thread to take their place.
+                for job in list(run.running):
+                    if now - job.started >= self.job_timeout_seconds:
+                        job.timed_out = True
+                        self.release(run, job)
+                        if run.waiting:
+                            self.start_worker(run)
+
+                wake_at = run.deadline
+                for job in run.running:
+                    wake_at = min(wake_at, job.started + self.job_timeout_seconds)
+                run.condition.wait(max(0.1, wake_at - now))
+
+            for job in jobs:
+                if not job.finished:
+                    job.timed_out = True
+            run.waiting = []
+
+        num_succeeded = len([job for job in jobs if job.succeeded])
+        num_timed_out = len([job for job in jobs if job.timed_out])
+        logger.info(u"scrape engine finished {} of {} jobs ({} timed out) on {} threads in {} seconds".format(
+            num_succeeded, len(jobs), num_timed_out, run.num_threads, elapsed(start_time)))
+        logger.info(u"page rule stats so far: {}".format(page_rule_stats()))
+        return jobs
+
+    def start_worker(self, run):
+        # call with run.condition held
+        worker = Thread(target=self.worker, args=[run])
+        # daemon, so abandoned scrapes can't keep the process alive
+        worker.daemon = True
+        worker.start()
+        run.num_threads += 1
+
+    def release(self, run, job):
+        # call with run.condition held
+        run.running.remove(job)
+        if job.host:
+            run.in_flight_per_host[job.host] -= 1
+        run.condition.notify_all()
+
+    def next_job(self, run):
+        # call with run.condition held
+        while run.waiting and time() < run.deadline:
+            # take the first job whose host is free and not rate limited, so one slow
+            # or backed-off host doesn't hold up everything queued behind it
+            soonest_ready = None
+            for index, job in enumerate(run.waiting):
+                if not job.host:
+                    return run.waiting.pop(index)
+                if run.in_flight_per_host[job.host] >= self.max_per_host:
+                    continue
+                seconds_until_ready = host_scheduler.seconds_until_ready(job.host)
+                if seconds_until_ready <= 0:
+                    run.in_flight_per_host[job.host] += 1
+                    return run.waiting.pop(index)
+                soonest_ready = min(soonest_ready or seconds_until_ready, seconds_until_ready)
+
+            # wait for something to finish, or for the next host to come off its rate limit
+            wait = run.deadline - time()
+            if soonest_ready is not None:
+                wait = min(wait, soonest_ready)
+            run.condition.wait(wait)
+        return None
+
+    def worker(self, run):
+        while True:
+            with run.condition:
+                job = self.next_job(run)
+                if not job:
+                    return
+                job.started = time()
+                run.running.append(job)
+                # so run() knows when this one is due
+                run.condition.notify_all()
+
+            result = None
+            error = None
+            try:
+                result = job.fn()
+            except Exception as e:
+                logger.exception(u"exception in scrape engine job {}".format(job))
+                error = e
+
+            with run.condition:
+                if job.timed_out:
+                    # run() already gave up on this job, freed its host and replaced this thread
+                    return
+                job.result = result
+                job.error = error
+                job.finished = time()
+                self.release(run, job)
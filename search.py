@@ -2,6 +2,7 @@ from sqlalchemy import sql
 
 from app import db
 from pub import Pub
+from pub import query_pubs
 
 def fulltext_search_title(query):
     query_string = """
@@ -13,7 +14,7 @@ def fulltext_search_title(query):
 
     rows = db.engine.execute(sql.text(query_string)).fetchall()
     ids = [row[0] for row in rows]
-    my_pubs = db.session.query(Pub).filter(Pub.id.in_(ids)).all()
+    my_pubs = query_pubs("full_recalculate").filter(Pub.id.in_(ids)).all()
     for row in rows:
         my_id = row[0]
         for my_pub in my_pubs:
@@ -0,0 +1,53 @@
+import unittest
+from nose.tools import assert_equals
+from nose.tools import assert_true
+import requests
+
+import http_cache
+from host_scheduler import HostScheduler
+
+
+# run like this:
+# nosetests test/test_host_scheduler.py
+
+
+def build_response(url, status_code, headers):
+    r = requests.models.Response()
+    r.url = url
+    r.status_code = status_code
+    r.headers = requests.structures.CaseInsensitiveDict(headers)
+    r.request = requests.Request("GET", url).prepare()
+    r._content = b""
+    r._content_consumed = True
+    return r
+
+
+class RedirectingSession(object):
+    # doi.org redirects to the publisher, which says slow down
+    def __init__(self):
+        self.cookies = requests.cookies.RequestsCookieJar()
+
+    def get(self, url, hooks=None, **kwargs):
+        redirect = build_response(url, 302, {"Location": "https://publisher.example.com/article/1"})
+        hooks["response"](redirect)
+        return build_response("https://publisher.example.com/article/1", 429, {"Retry-After": "300"})
+
+
+class TestHostScheduler(unittest.TestCase):
+    def setUp(self):
+        self.saved_host_scheduler = http_cache.host_scheduler
+        self.saved_get_pooled_session = http_cache.get_pooled_session
+        http_cache.host_scheduler = HostScheduler()
+        http_cache.get_pooled_session = lambda ask_slowly=False: RedirectingSession()
+
+    def tearDown(self):
+        http_cache.host_scheduler = self.saved_host_scheduler
+        http_cache.get_pooled_session = self.saved_get_pooled_session
+
+    def test_retry_after_from_redirect_target_blocks_only_that_host(self):
+        r = http_cache.http_get("https://doi.org/10.1234/example")
+        assert_equals(r.status_code, 429)
+
+        scheduler = http_cache.host_scheduler
+        assert_true(scheduler.seconds_until_ready("publisher.example.com") > 200)
+        assert_equals(scheduler.seconds_until_ready("doi.org"), 0)
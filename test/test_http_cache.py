@@ -0,0 +1,62 @@
+import shutil
+import tempfile
+import unittest
+from io import BytesIO
+from nose.tools import assert_equals
+import requests
+
+import http_cache
+from host_scheduler import HostScheduler
+
+
+# run like this:
+# nosetests test/test_http_cache.py
+
+
+class CountingSession(object):
+    def __init__(self, body):
+        self.cookies = requests.cookies.RequestsCookieJar()
+        self.body = body
+        self.num_gets = 0
+
+    def get(self, url, stream=False, **kwargs):
+        self.num_gets += 1
+        r = requests.models.Response()
+        r.url = url
+        r.status_code = 200
+        r.headers = requests.structures.CaseInsensitiveDict({"Content-Type": "text/html"})
+        r.request = requests.Request("GET", url).prepare()
+        r.raw = BytesIO(self.body)
+        return r
+
+
+class TestHttpCache(unittest.TestCase):
+    def setUp(self):
+        self.saved = (http_cache.HTTP_CACHE_DIR, http_cache.host_scheduler, http_cache.get_pooled_session)
+        http_cache.HTTP_CACHE_DIR = tempfile.mkdtemp()
+        http_cache.host_scheduler = HostScheduler()
+        self.session = CountingSession(b"<html>" + b"landing page " * 10000 + b"</html>")
+        http_cache.get_pooled_session = lambda ask_slowly=False: self.session
+
+    def tearDown(self):
+        shutil.rmtree(http_cache.HTTP_CACHE_DIR)
+        (http_cache.HTTP_CACHE_DIR, http_cache.host_scheduler, http_cache.get_pooled_session) = self.saved
+
+    def test_streamed_body_is_cached_once_read(self):
+        url = u"https://publisher.example.com/article/1"
+        r = http_cache.http_get(url, stream=True, cache_enabled=True)
+        assert_equals(r.content_big(), self.session.body)
+        assert_equals(self.session.num_gets, 1)
+
+        cached_r = http_cache.http_get(url, stream=True, cache_enabled=True)
+        assert_equals(self.session.num_gets, 1)
+        assert_equals(cached_r.status_code, 200)
+        assert_equals(cached_r.content_big(), self.session.body)
+
+    def test_streamed_body_not_cached_if_not_read(self):
+        url = u"https://publisher.example.com/article/2"
+        r = http_cache.http_get(url, stream=True, cache_enabled=True)
+        r.content_prefix(100)
+
+        http_cache.http_get(url, stream=True, cache_enabled=True)
+        assert_equals(self.session.num_gets, 2)
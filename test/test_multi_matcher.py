@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from nose.tools import assert_equals
+
+import oa_local
+import pmh_record
+import webpage
+from multi_matcher import MultiMatcher
+
+
+# run like this:
+# nosetests test/test_multi_matcher.py
+
+
+sample_texts = [
+    u"https://www.ncbi.nlm.nih.gov/pmc/articles/PMC3039489",
+    u"http://europepmc.org/abstract/MED/123",
+    u"https://www.researchgate.net/publication/1",
+    u"ftp://ftp.example.com/paper.pdf",
+    u"https://zenodo.org/record/1238858/files/data.tar.gz",
+    u"http://www.jstor.org/action/showSubscriptions",
+    u"http://www.bioone.org/doi/full/10.1642/AUK-18-8.1",
+    u"http://www.nature.com/articles/srep29901.pdf",
+    u"https://doi.org/10.1371/journal.pone.0153011",
+    u"https://arxiv.org/abs/1234.5678",
+    u"10.1101/123456",
+    u"Supplementary Figures",
+    u"Download Statistics",
+    u"FAQ",
+    u"Full text PDF",
+    u"http://elar.urfu.ru/handle/10995/1",
+    u"http://example.com/Pubmed/1",
+    u"http://example.com/{{ template }}",
+    u"",
+    u"http://example.com/caf\xe9/文献.pdf",
+    "http://example.com/bytes/\xff\xfe.pdf"
+]
+
+
+class TestMultiMatcher(unittest.TestCase):
+    # the matchers have to give the same answers as the `in` loops they replaced
+
+    def check_same_as_list(self, matcher, words, lowercase_text):
+        for text in sample_texts:
+            old_text = MultiMatcher([]).normalize(text)
+            if lowercase_text:
+                old_text = old_text.lower()
+            expected = any([word in old_text for word in words])
+            assert_equals(matcher.matches(text), expected, u"{} on {}".format(words, repr(text)))
+
+    def test_href_blacklist(self):
+        self.check_same_as_list(webpage.bad_href_matcher, webpage.HREF_BLACKLIST, True)
+
+    def test_anchor_blacklist(self):
+        self.check_same_as_list(webpage.bad_anchor_matcher, webpage.ANCHOR_BLACKLIST, True)
+
+    def test_dont_scrape_list(self):
+        self.check_same_as_list(webpage.dont_scrape_matcher, webpage.DONT_SCRAPE_LIST, False)
+
+    def test_pmh_blacklist(self):
+        self.check_same_as_list(pmh_record.blacklist_url_matcher, pmh_record.BLACKLIST_URL_SNIPPETS, False)
+
+    def test_open_fragments(self):
+        self.check_same_as_list(oa_local.open_url_fragment_matcher, oa_local.open_url_fragments, False)
+        self.check_same_as_list(oa_local.open_doi_fragment_matcher, oa_local.open_doi_fragments, False)
+
+    def test_ignore_case(self):
+        matcher = MultiMatcher([u"ShowSubscriptions"], ignore_case=True)
+        assert_equals(matcher.search(u"http://www.jstor.org/action/SHOWSUBSCRIPTIONS"), u"showsubscriptions")
+        assert_equals(matcher.search(u"http://www.jstor.org/"), None)
@@ -0,0 +1,43 @@
+import unittest
+from nose.tools import assert_equals
+
+import page
+from page import PageNew
+from pdf_verdict import PdfVerdict
+
+
+# run like this:
+# nosetests test/test_pdf_verdict.py
+
+
+class DownloadNotExpected(Exception):
+    pass
+
+
+def no_download(**kwargs):
+    raise DownloadNotExpected(kwargs)
+
+
+class TestPdfVerdict(unittest.TestCase):
+    def setUp(self):
+        self.saved = (page.get_pdf_verdict_for_url, page.PmhRepoWebpage)
+        page.PmhRepoWebpage = no_download
+
+    def tearDown(self):
+        (page.get_pdf_verdict_for_url, page.PmhRepoWebpage) = self.saved
+
+    def test_recent_verdict_for_pdf_url_skips_download(self):
+        pdf_url = u"https://repository.example.edu/bitstream/1/paper.pdf"
+        verdicts = {pdf_url: PdfVerdict(url=pdf_url, version=u"publishedVersion", license=u"cc-by")}
+        page.get_pdf_verdict_for_url = lambda url: verdicts.get(url, None)
+
+        my_page = PageNew(url=u"https://repository.example.edu/handle/1", scrape_pdf_url=pdf_url)
+        my_page.finish_scrape(None)
+        assert_equals(my_page.scrape_version, u"publishedVersion")
+        assert_equals(my_page.scrape_license, u"cc-by")
+
+    def test_unknown_pdf_url_is_downloaded(self):
+        page.get_pdf_verdict_for_url = lambda url: None
+
+        my_page = PageNew(url=u"https://repository.example.edu/handle/2", scrape_pdf_url=u"https://repository.example.edu/bitstream/2/paper.pdf")
+        self.assertRaises(DownloadNotExpected, my_page.finish_scrape, None)
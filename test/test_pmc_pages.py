@@ -0,0 +1,39 @@
+import unittest
+from nose.tools import assert_equals
+from sqlalchemy.orm.attributes import set_committed_value
+
+import pub
+from oa_pmc import PmcInfo
+from page import Page
+from pub import Pub
+
+
+# run like this:
+# nosetests test/test_pmc_pages.py
+
+
+class TestPmcPages(unittest.TestCase):
+    def setUp(self):
+        self.saved_get_pmc_info = pub.get_pmc_info
+        self.asked_about = []
+
+        def fake_get_pmc_info(pmcids):
+            self.asked_about += pmcids
+            return {"pmc3039489": PmcInfo(pmcid="pmc3039489", has_pdf=u"Y", auth_man=u"Y", is_open_access=u"Y", license=u"cc by")}
+        pub.get_pmc_info = fake_get_pmc_info
+
+    def tearDown(self):
+        pub.get_pmc_info = self.saved_get_pmc_info
+
+    def test_legacy_pmc_page_gets_version_and_license(self):
+        my_page = Page(url=u"http://www.ncbi.nlm.nih.gov/pmc/articles/PMC3039489", id=u"oai:pubmedcentral.nih.gov:3039489")
+        my_pub = Pub(id=u"10.1234/example")
+        set_committed_value(my_pub, "page_matches_by_doi", [my_page])
+        set_committed_value(my_pub, "page_new_matches_by_doi", [])
+        set_committed_value(my_pub, "page_new_matches_by_title", [])
+
+        assert_equals(my_pub.pages, [my_page])
+        assert_equals(self.asked_about, [u"pmc3039489"])
+        assert_equals(my_page.scrape_version, u"acceptedVersion")
+        assert_equals(my_page.scrape_license, u"cc-by")
+        assert_equals(my_page.scrape_pdf_url, u"http://europepmc.org/articles/pmc3039489?pdf=render")
@@ -9,6 +9,7 @@ import urlparse
 import re
 import os
 import collections
+import functools
 import requests
 import heroku3
 import json
@@ -19,6 +20,7 @@ from lxml import html
 from sqlalchemy import sql
 from sqlalchemy import exc
 from subprocess import call
+from threading import Lock
 from requests.adapters import HTTPAdapter
 
 class NoDoiException(Exception):
@@ -179,14 +181,43 @@ def safe_commit(db):
 
 
 
+def lru_cache(max_items):
+    # python 2 doesn't have functools.lru_cache.  positional args only, and they have to be hashable.
+    def decorator(fn):
+        items = collections.OrderedDict()
+        lock = Lock()
+
+        @functools.wraps(fn)
+        def wrapper(*args):
+            with lock:
+                if args in items:
+                    # move it to the end, so it is the most recently used
+                    value = items.pop(args)
+                    items[args] = value
+                    return value
+            value = fn(*args)
+            with lock:
+                items[args] = value
+                while len(items) > max_items:
+                    items.popitem(last=False)
+            return value
+        return wrapper
+    return decorator
+
+
+# test urls at https://regex101.com/r/yX5cK0/2
+DOI_URL_PATTERN = re.compile(u"https?:\/\/(?:dx.)?doi.org\/(.*)")
+
+# test cases for this regex are at https://regex101.com/r/zS4hA0/1
+DOI_PATTERN = re.compile(ur'(10\.\d+\/[^\s]+)')
+
+
+@lru_cache(100*1000)
 def is_doi_url(url):
     if not url:
         return False
 
-    # test urls at https://regex101.com/r/yX5cK0/2
-    p = re.compile("https?:\/\/(?:dx.)?doi.org\/(.*)")
-    matches = re.findall(p, url.lower())
-    if len(matches) > 0:
+    if DOI_URL_PATTERN.search(url.lower()):
         return True
     return False
 
@@ -197,20 +228,25 @@ def clean_doi(dirty_doi, return_none_if_error=False):
         else:
             raise NoDoiException("There's no DOI at all.")
 
-    dirty_doi = dirty_doi.strip()
-    dirty_doi = dirty_doi.lower()
-
-    # test cases for this regex are at https://regex101.com/r/zS4hA0/1
-    p = re.compile(ur'(10\.\d+\/[^\s]+)')
-
-    matches = re.findall(p, dirty_doi)
-    if len(matches) == 0:
+    resp = find_clean_doi(dirty_doi)
+    if not resp:
         if return_none_if_error:
             return None
         else:
             raise NoDoiException("There's no valid DOI.")
+    return resp
+
+@lru_cache(100*1000)
+def find_clean_doi(dirty_doi):
+    # the clean doi in dirty_doi, or None if there isn't one
+    dirty_doi = dirty_doi.strip()
+    dirty_doi = dirty_doi.lower()
+
+    match = DOI_PATTERN.search(dirty_doi)
+    if not match:
+        return None
 
-    match = matches[0]
+    match = match.group(1)
     match = remove_nonprinting_characters(match)
 
     try:
@@ -7,6 +7,7 @@ from flask import jsonify
 from flask import g
 from flask import url_for
 from flask import Response
+from flask import stream_with_context
 
 import json
 import os
@@ -26,8 +27,6 @@ from app import logger
 import pub
 import repository
 from save_accuracy_report import AccuracyReport
-from emailer import create_email
-from emailer import send
 from search import fulltext_search_title
 from search import autocomplete_phrases
 from changefile import get_changefile_dicts
@@ -38,6 +37,9 @@ from util import safe_commit
 from util import elapsed
 from util import clean_doi
 from util import restart_dynos
+from response_cache import response_cache
+from export_job import ExportJob
+from export_job import enqueue_export_job
 
 
 
@@ -244,7 +246,8 @@ def get_pub_from_doi(doi):
     try:
         my_pub = pub.get_pub_from_biblio({"doi": doi},
                                          run_with_hybrid=run_with_hybrid,
-                                         skip_all_hybrid=skip_all_hybrid
+                                         skip_all_hybrid=skip_all_hybrid,
+                                         load_profile="full_recalculate"
                                          )
     except NoDoiException:
         abort_json(404, u"'{}' is an invalid doi.  See http://doi.org/{}".format(doi, doi))
@@ -426,60 +429,154 @@ def base_endpoint_v2():
         "msg": "Don't panic"
     })
 
+def log_crossref_record_cache_stats(my_pub):
+    logger.info(u"crossref record cache for {}: {}".format(
+        my_pub.id, json.dumps(my_pub.crossref_record_cache_stats)))
+
+# returns (validator, cached response or None).  the validator is looked up before the
+# response is made, so a change that lands in between just means a miss next time.
+def get_cached_response(version, doi):
+    if g.hybrid:
+        return (None, None)
+    my_clean_doi = clean_doi(doi, return_none_if_error=True)
+    if not my_clean_doi:
+        return (None, None)
+    validator = pub.get_response_cache_validator(my_clean_doi)
+    return (validator, response_cache.get(version, my_clean_doi, validator))
+
 @app.route("/<path:doi>", methods=["GET"])
 def get_doi_endpoint(doi):
     # the GET api endpoint (returns json data)
+    (validator, cached_response) = get_cached_response("v1", doi)
+    if cached_response:
+        return jsonify(cached_response)
+
     my_pub = get_pub_from_doi(doi)
-    return jsonify({"results": [my_pub.to_dict_v1()]})
+    response = {"results": [my_pub.to_dict_v1()]}
+    log_crossref_record_cache_stats(my_pub)
+    response_cache.set("v1", my_pub.id, response, validator)
+    return jsonify(response)
 
 @app.route("/v2/<path:doi>", methods=["GET"])
 def get_doi_endpoint_v2(doi):
     # the GET api endpoint (returns json data)
+    (validator, cached_response) = get_cached_response("v2", doi)
+    if cached_response:
+        return jsonify(cached_response)
+
+    # serve what update already stored, unless we have to recalculate
+    if not g.hybrid:
+        try:
+            stored_response = pub.get_stored_response_from_doi(doi)
+        except NoDoiException:
+            abort_json(404, u"'{}' is an invalid doi.  See http://doi.org/{}".format(doi, doi))
+        if stored_response:
+            response_cache.set("v2", clean_doi(doi), stored_response, validator)
+            return jsonify(stored_response)
+
     my_pub = get_pub_from_doi(doi)
-    return jsonify(my_pub.to_dict_v2())
+    response = my_pub.to_dict_v2()
+    log_crossref_record_cache_stats(my_pub)
+    response_cache.set("v2", my_pub.id, response, validator)
+    return jsonify(response)
+
+BULK_MAX_DOIS = 100*1000
+
+def bulk_dois_jsonl_lines(dirty_dois):
+    for (dirty_doi, my_clean_doi, is_in_db, response_jsonb) in bulk_dois_results(dirty_dois):
+        if response_jsonb:
+            line_dict = response_jsonb
+        else:
+            line_dict = {"doi": my_clean_doi or dirty_doi, "error": True, "message": bulk_doi_error(my_clean_doi, is_in_db)}
+        yield json.dumps(line_dict, sort_keys=True) + "\n"
+
+def bulk_dois_csv_lines(dirty_dois):
+    fieldnames = pub.csv_fieldnames() + ["error"]
+    buffer = BytesIO()
+    writer = unicodecsv.DictWriter(buffer, fieldnames=fieldnames, dialect='excel')
+    writer.writeheader()
+    for (dirty_doi, my_clean_doi, is_in_db, response_jsonb) in bulk_dois_results(dirty_dois):
+        if response_jsonb:
+            row = pub.csv_dict_from_response_dict(response_jsonb)
+        else:
+            row = {"doi": my_clean_doi or dirty_doi, "error": bulk_doi_error(my_clean_doi, is_in_db)}
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+def bulk_doi_error(my_clean_doi, is_in_db):
+    if not my_clean_doi:
+        return u"invalid doi"
+    if is_in_db:
+        # we have the pub, but it hasn't been calculated yet.  too slow to do it here for a bulk request.
+        return u"no stored response for this doi yet"
+    return u"doi not in database"
+
+def bulk_dois_results(dirty_dois):
+    # yields (dirty_doi, clean_doi, is_in_db, response_jsonb): invalid dois first, then the rest
+    # deduped and in the order given, with one db query per chunk
+    clean_dois = []
+    for dirty_doi in dirty_dois:
+        my_clean_doi = clean_doi(dirty_doi, return_none_if_error=True)
+        if my_clean_doi:
+            clean_dois.append(my_clean_doi)
+        else:
+            yield (dirty_doi, None, False, None)
+
+    seen_dois = set()
+    unique_clean_dois = []
+    for my_clean_doi in clean_dois:
+        if my_clean_doi not in seen_dois:
+            seen_dois.add(my_clean_doi)
+            unique_clean_dois.append(my_clean_doi)
+
+    for (my_clean_doi, is_in_db, response_jsonb) in pub.get_stored_responses_from_dois(unique_clean_dois):
+        yield (my_clean_doi, my_clean_doi, is_in_db, response_jsonb)
+
+@app.route("/v2/dois/bulk", methods=["POST"])
+def bulk_dois_endpoint():
+    body = request.json
+    if not body or not body.get("dois", None):
+        abort_json(400, "POST a json body with a list of dois, like {\"dois\": [\"10.1038/nature12373\"]}")
+    dirty_dois = body["dois"]
+    if len(dirty_dois) > BULK_MAX_DOIS:
+        abort_json(413, u"max number of DOIs is {}".format(BULK_MAX_DOIS))
+
+    return_type = body.get("return_type", "jsonl")
+    logger.info(u"in bulk_dois_endpoint with {} dois, return_type {}".format(len(dirty_dois), return_type))
+
+    if return_type == "csv":
+        output = Response(stream_with_context(bulk_dois_csv_lines(dirty_dois)), mimetype="text/csv")
+        output.headers["Content-Disposition"] = "attachment; filename=unpaywall_results.csv"
+    elif return_type == "jsonl":
+        output = Response(stream_with_context(bulk_dois_jsonl_lines(dirty_dois)), mimetype="application/x-jsonlines")
+    else:
+        abort_json(400, "return_type must be jsonl or csv")
+    return output
 
 @app.route("/v2/dois", methods=["POST"])
 def simple_query_tool():
     body = request.json
-    return_type = body.get("return_type", "csv")
     dirty_dois_list = body["dois"]
-
-    clean_dois = [clean_doi(dirty_doi, return_none_if_error=True) for dirty_doi in dirty_dois_list]
-    clean_dois = [doi for doi in clean_dois if doi]
-
-    q = db.session.query(pub.Pub.response_jsonb).filter(pub.Pub.id.in_(clean_dois))
-    rows = q.all()
-    pub_responses = [row[0] for row in rows]
-
-    # save jsonl
-    with open("output.jsonl", 'wb') as f:
-        for response_jsonb in pub_responses:
-            f.write(json.dumps(response_jsonb, sort_keys=True))
-            f.write("\n")
-
-    # save csv
-    csv_dicts = [pub.csv_dict_from_response_dict(my_dict) for my_dict in pub_responses]
-    csv_dicts = [my_dict for my_dict in csv_dicts if my_dict]
-    fieldnames = sorted(csv_dicts[0].keys())
-    fieldnames = ["doi"] + [name for name in fieldnames if name != "doi"]
-    with open("output.csv", 'wb') as f:
-        writer = unicodecsv.DictWriter(f, fieldnames=fieldnames, dialect='excel')
-        writer.writeheader()
-        for my_dict in csv_dicts:
-            writer.writerow(my_dict)
-
-    # prep email
     email_address = body["email"]
-    email = create_email(email_address,
-                 "Your Unpaywall results",
-                 "simple_query_tool",
-                 {"profile": {}},
-                 ["output.csv", "output.jsonl"])
-    send(email, for_real=True)
 
-    # @todo make sure in the return dict that there is a row for every doi
-    # even those not in our db
-    return jsonify({"got it": email_address, "dois": clean_dois})
+    # the export and the email happen in queue_export.py, not in this request
+    my_job = enqueue_export_job(email_address, dirty_dois_list)
+
+    return jsonify({
+        "got it": email_address,
+        "dois": my_job.dois,
+        "job_id": my_job.id,
+        "status_url": url_for("simple_query_tool_status", job_id=my_job.id, _external=True)
+    })
+
+@app.route("/v2/dois/job/<job_id>", methods=["GET"])
+def simple_query_tool_status(job_id):
+    my_job = ExportJob.query.get(job_id)
+    if not my_job:
+        abort_json(404, u"no job with id {}".format(job_id))
+    return jsonify(my_job.to_dict())
 
 
 @app.route("/feed/changefiles", methods=["GET"])
@@ -541,6 +638,10 @@ def accuracy_report():
     my_report.build_current_report()
     return jsonify(my_report.to_dict())
 
+@app.route("/admin/response_cache", methods=["GET"])
+def response_cache_stats():
+    return jsonify(response_cache.stats)
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))
     app.run(host='0.0.0.0', port=port, debug=True, threaded=True)
@@ -23,9 +23,17 @@ from util import NoDoiException
 from util import normalize
 from util import is_same_publisher
 from http_cache import is_response_too_large
+from page_rules import license_rules
+from page_rules import says_open_url_snippet_rules
+from page_rules import says_open_access_rules
+from page_rules import says_free_publisher_rules
+from multi_matcher import MultiMatcher
 
 DEBUG_SCRAPING = False
 
+# landing pages and pdfs go through the http_get cache, so re-scrapes don't refetch them
+SCRAPE_HTTP_CACHE_ENABLED = os.getenv("SCRAPE_HTTP_CACHE_ENABLED", "True") == "True"
+
 
 
 class Webpage(object):
@@ -116,7 +124,7 @@ class Webpage(object):
     def set_r_for_pdf(self):
         self.r = None
         try:
-            self.r = http_get(url=self.scraped_pdf_url, stream=False, publisher=self.publisher, session_id=self.session_id, ask_slowly=self.ask_slowly)
+            self.r = http_get(url=self.scraped_pdf_url, stream=False, cache_enabled=SCRAPE_HTTP_CACHE_ENABLED, publisher=self.publisher, session_id=self.session_id, ask_slowly=self.ask_slowly)
 
         except requests.exceptions.ConnectionError as e:
             self.error += u"ERROR: connection error on {} in set_r_for_pdf: {}".format(self.scraped_pdf_url, unicode(e.message).encode("utf-8"))
@@ -156,24 +164,16 @@ class Webpage(object):
                 logger.info(u"response is too big for more checks in gets_a_pdf")
             return False
 
-        content = self.r.content_big()
-
-        # PDFs start with this character
-        if re.match(u"%PDF", content):
+        # PDFs start with this character, so only read the first few bytes to check
+        if re.match(u"%PDF", self.r.content_prefix(1024)):
             return True
 
-        if self.publisher:
-            says_free_publisher_patterns = [
-                    ("Wiley-Blackwell", u'<span class="freeAccess" title="You have free access to this content">'),
-                    ("Wiley-Blackwell", u'<iframe id="pdfDocument"'),
-                    ("JSTOR", ur'<li class="download-pdf-button">.*Download PDF.*</li>'),
-                    ("Institute of Electrical and Electronics Engineers (IEEE)", ur'<frame src="http://ieeexplore.ieee.org/.*?pdf.*?</frameset>'),
-                    ("IOP Publishing", ur'Full Refereed Journal Article')
-                        ]
-            for (publisher, pattern) in says_free_publisher_patterns:
-                matches = re.findall(pattern, content, re.IGNORECASE | re.DOTALL)
-                if self.is_same_publisher(publisher) and matches:
-                    return True
+        # only download the whole page if this publisher has rules to look for in it
+        if self.publisher and says_free_publisher_rules.applicable_rules(publisher=self.publisher):
+            content = self.r.content_big()
+            # only this publisher's rules run, as one combined regex
+            if says_free_publisher_rules.first_match(content, publisher=self.publisher):
+                return True
         return False
 
 
@@ -205,7 +205,7 @@ class Webpage(object):
     
         start = time()
         try:
-            self.r = http_get(absolute_url, stream=True, publisher=self.publisher, session_id=self.session_id, ask_slowly=self.ask_slowly)
+            self.r = http_get(absolute_url, stream=True, cache_enabled=SCRAPE_HTTP_CACHE_ENABLED, publisher=self.publisher, session_id=self.session_id, ask_slowly=self.ask_slowly)
 
             if self.r.status_code != 200:
                 if self.r.status_code in [401]:
@@ -218,6 +218,9 @@ class Webpage(object):
             if self.is_a_pdf_page():
                 return True
 
+            # not a pdf, so don't download the rest of it
+            self.r.close()
+
         except requests.exceptions.ConnectionError as e:
             self.error += u"ERROR: connection error in gets_a_pdf for {}: {}".format(absolute_url, unicode(e.message).encode("utf-8"))
             logger.info(self.error)
@@ -358,7 +361,7 @@ class PublisherWebpage(Webpage):
 
         start = time()
         try:
-            self.r = http_get(landing_url, stream=True, publisher=self.publisher, session_id=self.session_id, ask_slowly=self.ask_slowly)
+            self.r = http_get(landing_url, stream=True, cache_enabled=SCRAPE_HTTP_CACHE_ENABLED, publisher=self.publisher, session_id=self.session_id, ask_slowly=self.ask_slowly)
 
             if self.r.status_code != 200:
                 if self.r.status_code in [401]:
@@ -389,11 +392,11 @@ class PublisherWebpage(Webpage):
                 if DEBUG_SCRAPING:
                     logger.info(u"landing page is not a PDF for {}.  continuing more checks".format(landing_url))
 
-            # get the HTML tree
-            page = self.r.content_small()
+            # parsed once, shared by all the checks below
+            page = ParsedPage(self.r.content_small())
 
             # set the license if we can find one
-            scraped_license = find_normalized_license(page)
+            scraped_license = page.license
             if scraped_license:
                 self.scraped_license = scraped_license
 
@@ -407,43 +410,20 @@ class PublisherWebpage(Webpage):
                     self.open_version_source_string = "open (via free pdf)"
 
             # now look and see if it is not just free, but open!
-            license_patterns = [u"(creativecommons.org\/licenses\/[a-z\-]+)",
-                        u"distributed under the terms (.*) which permits",
-                        u"This is an open access article under the terms (.*) which permits",
-                        u"This is an open access article published under (.*) which permits",
-                        u'<div class="openAccess-articleHeaderContainer(.*?)</div>'
-                        ]
-            for pattern in license_patterns:
-                matches = re.findall(pattern, page, re.IGNORECASE)
-                if matches:
-                    self.scraped_license = find_normalized_license(matches[0])
-                    self.scraped_open_metadata_url = self.url
-                    self.open_version_source_string = "open (via page says license)"
-
-
-            says_open_url_snippet_patterns = [("projecteuclid.org/", u'<strong>Full-text: Open access</strong>'),
-                        ]
-            for (url_snippet, pattern) in says_open_url_snippet_patterns:
-                matches = re.findall(pattern, self.r.content_small(), re.IGNORECASE)
-                if url_snippet in self.r.request.url.lower() and matches:
-                    self.scraped_open_metadata_url = self.r.request.url
-                    self.open_version_source_string = "open (via page says Open Access)"
-                    self.scraped_license = "implied-oa"
-
-            says_open_access_patterns = [("Informa UK Limited", u"/accessOA.png"),
-                        ("Oxford University Press (OUP)", u"<i class='icon-availability_open'"),
-                        ("Institute of Electrical and Electronics Engineers (IEEE)", ur'"isOpenAccess":true'),
-                        ("Institute of Electrical and Electronics Engineers (IEEE)", ur'"openAccessFlag":"yes"'),
-                        ("Informa UK Limited", u"/accessOA.png"),
-                        ("Royal Society of Chemistry (RSC)", u"/open_access_blue.png"),
-                        ("Cambridge University Press (CUP)", u'<span class="icon access open-access cursorDefault">'),
-                        ]
-            for (publisher, pattern) in says_open_access_patterns:
-                matches = re.findall(pattern, page, re.IGNORECASE | re.DOTALL)
-                if self.is_same_publisher(publisher) and matches:
-                    self.scraped_license = "implied-oa"
-                    self.scraped_open_metadata_url = landing_url
-                    self.open_version_source_string = "open (via page says Open Access)"
+            for (rule, first_match) in license_rules.all_matches(page.html):
+                self.scraped_license = find_normalized_license(first_match)
+                self.scraped_open_metadata_url = self.url
+                self.open_version_source_string = "open (via page says license)"
+
+            if says_open_url_snippet_rules.first_match(page.html, url=self.r.request.url):
+                self.scraped_open_metadata_url = self.r.request.url
+                self.open_version_source_string = "open (via page says Open Access)"
+                self.scraped_license = "implied-oa"
+
+            if says_open_access_rules.first_match(page.html, publisher=self.publisher):
+                self.scraped_license = "implied-oa"
+                self.scraped_open_metadata_url = landing_url
+                self.open_version_source_string = "open (via page says Open Access)"
 
             if self.is_open:
                 if DEBUG_SCRAPING:
@@ -485,6 +465,19 @@ class PublisherWebpage(Webpage):
             return False
 
 
+DONT_SCRAPE_LIST = [
+    u"ncbi.nlm.nih.gov",
+    u"europepmc.org",
+    u"/europepmc/",
+    u"pubmed",
+    u"elar.rsvpu.ru",  #these ones based on complaint in email
+    u"elib.uraic.ru",
+    u"elar.usfeu.ru",
+    u"elar.urfu.ru",
+    u"elar.uspu.ru"]
+dont_scrape_matcher = MultiMatcher(DONT_SCRAPE_LIST)
+
+
 # abstract.  inherited by PmhRepoWebpage
 class RepoWebpage(Webpage):
     @property
@@ -495,23 +488,12 @@ class RepoWebpage(Webpage):
     def scrape_for_fulltext_link(self):
         url = self.url
 
-        dont_scrape_list = [
-                u"ncbi.nlm.nih.gov",
-                u"europepmc.org",
-                u"/europepmc/",
-                u"pubmed",
-                u"elar.rsvpu.ru",  #these ones based on complaint in email
-                u"elib.uraic.ru",
-                u"elar.usfeu.ru",
-                u"elar.urfu.ru",
-                u"elar.uspu.ru"]
-        for url_fragment in dont_scrape_list:
-            if url_fragment in url:
-                logger.info(u"not scraping {} because is on our do not scrape list.".format(url))
-                return
+        if dont_scrape_matcher.matches(url):
+            logger.info(u"not scraping {} because is on our do not scrape list.".format(url))
+            return
 
         try:
-            self.r = http_get(url, stream=True, publisher=self.publisher, session_id=self.session_id, ask_slowly=self.ask_slowly)
+            self.r = http_get(url, stream=True, cache_enabled=SCRAPE_HTTP_CACHE_ENABLED, publisher=self.publisher, session_id=self.session_id, ask_slowly=self.ask_slowly)
 
             if self.r.status_code != 200:
                 if self.r.status_code in [401]:
@@ -538,11 +520,11 @@ class RepoWebpage(Webpage):
                 logger.info(u"landing page is too large, skipping")
                 return
 
-            # get the HTML tree
-            page = self.r.content_small()
+            # parsed once, shared by all the checks below
+            page = ParsedPage(self.r.content_small())
 
             # set the license if we can find one
-            scraped_license = find_normalized_license(page)
+            scraped_license = page.license
             if scraped_license:
                 self.scraped_license = scraped_license
 
@@ -551,7 +533,7 @@ class RepoWebpage(Webpage):
             # osf doesn't have their download link in their pages
             # so look at the page contents to see if it is osf-hosted
             # if so, compute the url.  example:  http://osf.io/tyhqm
-            if page and u"osf-cookie" in unicode(page, "utf-8"):
+            if page.html and u"osf-cookie" in page.text:
                 pdf_download_link = DuckLink(u"{}/download".format(url), "download")
 
             # otherwise look for it the normal way
@@ -656,10 +638,61 @@ class DuckLink(object):
         self.anchor = anchor
 
 
+class ParsedPage(object):
+    """
+    The html of one landing page, with the lxml tree, the useful links, the decoded
+    text and the license each worked out at most once.  The detectors in this file
+    take one of these instead of the raw html.
+    """
+    def __init__(self, html):
+        self.html = html
+        self._tree = None
+        self._tree_is_parsed = False
+        self._useful_links = None
+        self._text = None
+        self._license = None
+        self._license_is_found = False
+
+    @property
+    def tree(self):
+        if not self._tree_is_parsed:
+            self._tree = get_tree(self.html)
+            self._tree_is_parsed = True
+        return self._tree
+
+    @property
+    def useful_links(self):
+        if self._useful_links is None:
+            self._useful_links = build_useful_links(self.tree)
+        return self._useful_links
+
+    @property
+    def text(self):
+        if self._text is None:
+            self._text = unicode(self.html, "utf-8")
+        return self._text
+
+    @property
+    def license(self):
+        if not self._license_is_found:
+            self._license = find_normalized_license(self.html)
+            self._license_is_found = True
+        return self._license
+
+
+def as_parsed_page(page):
+    if isinstance(page, ParsedPage):
+        return page
+    return ParsedPage(page)
+
+
 def get_useful_links(page):
+    return as_parsed_page(page).useful_links
+
+
+def build_useful_links(tree):
     links = []
 
-    tree = get_tree(page)
     if tree is None:
         return []
 
@@ -710,126 +743,124 @@ def is_purchase_link(link):
     return False
 
 
-def has_bad_href_word(href):
-    href_blacklist = [
-        # = closed 10.1021/acs.jafc.6b02480
-        # editorial and advisory board
-        "/eab/",
+HREF_BLACKLIST = [
+    # = closed 10.1021/acs.jafc.6b02480
+    # editorial and advisory board
+    "/eab/",
 
-        # = closed 10.1021/acs.jafc.6b02480
-        "/suppl_file/",
+    # = closed 10.1021/acs.jafc.6b02480
+    "/suppl_file/",
 
-        # https://lirias.kuleuven.be/handle/123456789/372010
-        "supplementary+file",
+    # https://lirias.kuleuven.be/handle/123456789/372010
+    "supplementary+file",
 
-        # http://www.jstor.org/action/showSubscriptions
-        "showsubscriptions",
+    # http://www.jstor.org/action/showSubscriptions
+    "showsubscriptions",
 
-        # 10.7763/ijiet.2014.v4.396
-        "/faq",
+    # 10.7763/ijiet.2014.v4.396
+    "/faq",
 
-        # 10.1515/fabl.1988.29.1.21
-        "{{",
+    # 10.1515/fabl.1988.29.1.21
+    "{{",
 
-        # 10.2174/1389450116666150126111055
-        "cdt-flyer",
+    # 10.2174/1389450116666150126111055
+    "cdt-flyer",
 
-        # 10.1111/fpa.12048
-        "figures",
+    # 10.1111/fpa.12048
+    "figures",
 
-        # https://www.crossref.org/iPage?doi=10.3138%2Fecf.22.1.1
-        "price-lists",
+    # https://www.crossref.org/iPage?doi=10.3138%2Fecf.22.1.1
+    "price-lists",
 
-        # prescribing information, see http://www.nejm.org/doi/ref/10.1056/NEJMoa1509388#t=references
-        "janssenmd.com",
+    # prescribing information, see http://www.nejm.org/doi/ref/10.1056/NEJMoa1509388#t=references
+    "janssenmd.com",
 
-        # prescribing information, see http://www.nejm.org/doi/ref/10.1056/NEJMoa1509388#t=references
-        "community-register",
+    # prescribing information, see http://www.nejm.org/doi/ref/10.1056/NEJMoa1509388#t=references
+    "community-register",
 
-        # prescribing information, see http://www.nejm.org/doi/ref/10.1056/NEJMoa1509388#t=references
-        "quickreference",
+    # prescribing information, see http://www.nejm.org/doi/ref/10.1056/NEJMoa1509388#t=references
+    "quickreference",
 
-        # 10.4158/ep.14.4.458
-        "libraryrequestform",
+    # 10.4158/ep.14.4.458
+    "libraryrequestform",
 
-        # http://www.nature.com/nutd/journal/v6/n7/full/nutd201620a.html
-        "iporeport",
+    # http://www.nature.com/nutd/journal/v6/n7/full/nutd201620a.html
+    "iporeport",
 
-        #https://ora.ox.ac.uk/objects/uuid:06829078-f55c-4b8e-8a34-f60489041e2a
-        "no_local_copy",
+    #https://ora.ox.ac.uk/objects/uuid:06829078-f55c-4b8e-8a34-f60489041e2a
+    "no_local_copy",
 
-        ".zip",
+    ".zip",
 
-        # https://zenodo.org/record/1238858
-        ".gz",
+    # https://zenodo.org/record/1238858
+    ".gz",
 
-        # https://zenodo.org/record/1238858
-        ".tar.",
+    # https://zenodo.org/record/1238858
+    ".tar.",
 
-        # http://www.bioone.org/doi/full/10.1642/AUK-18-8.1
-        "/doi/full/10.1642",
+    # http://www.bioone.org/doi/full/10.1642/AUK-18-8.1
+    "/doi/full/10.1642",
 
-        # dating site :(  10.1137/S0036142902418680 http://citeseerx.ist.psu.edu/viewdoc/summary?doi=10.1.1.144.7627
-        "hyke.org",
+    # dating site :(  10.1137/S0036142902418680 http://citeseerx.ist.psu.edu/viewdoc/summary?doi=10.1.1.144.7627
+    "hyke.org",
 
-        # is a citation http://orbit.dtu.dk/en/publications/autonomous-multisensor-microsystem-for-measurement-of-ocean-water-salinity(1dea807b-c309-40fd-a623-b6c28999f74f).html
-        "&rendering=",
-    ]
-    for bad_word in href_blacklist:
-        if bad_word in href.lower():
-            return True
-    return False
+    # is a citation http://orbit.dtu.dk/en/publications/autonomous-multisensor-microsystem-for-measurement-of-ocean-water-salinity(1dea807b-c309-40fd-a623-b6c28999f74f).html
+    "&rendering=",
+]
+bad_href_matcher = MultiMatcher(HREF_BLACKLIST, ignore_case=True)
 
+def has_bad_href_word(href):
+    return bad_href_matcher.matches(href)
 
-def has_bad_anchor_word(anchor_text):
-    anchor_blacklist = [
-        # = closed repo https://works.bepress.com/ethan_white/27/
-        "user",
-        "guide",
 
-        # = closed 10.1038/ncb3399
-        "checklist",
+ANCHOR_BLACKLIST = [
+    # = closed repo https://works.bepress.com/ethan_white/27/
+    "user",
+    "guide",
 
-        # wrong link
-        "abstracts",
+    # = closed 10.1038/ncb3399
+    "checklist",
 
-        # http://orbit.dtu.dk/en/publications/autonomous-multisensor-microsystem-for-measurement-of-ocean-water-salinity(1dea807b-c309-40fd-a623-b6c28999f74f).html
-        "downloaded publications",
+    # wrong link
+    "abstracts",
 
-        # https://hal.archives-ouvertes.fr/hal-00085700
-        "metadata from the pdf file",
-        u"récupérer les métadonnées à partir d'un fichier pdf",
+    # http://orbit.dtu.dk/en/publications/autonomous-multisensor-microsystem-for-measurement-of-ocean-water-salinity(1dea807b-c309-40fd-a623-b6c28999f74f).html
+    "downloaded publications",
 
-        # = closed http://europepmc.org/abstract/med/18998885
-        "bulk downloads",
+    # https://hal.archives-ouvertes.fr/hal-00085700
+    "metadata from the pdf file",
+    u"récupérer les métadonnées à partir d'un fichier pdf",
 
-        # http://www.utpjournals.press/doi/pdf/10.3138/utq.35.1.47
-        "license agreement",
+    # = closed http://europepmc.org/abstract/med/18998885
+    "bulk downloads",
 
-        # = closed 10.1021/acs.jafc.6b02480
-        "masthead",
+    # http://www.utpjournals.press/doi/pdf/10.3138/utq.35.1.47
+    "license agreement",
 
-        # closed http://eprints.soton.ac.uk/342694/
-        "download statistics",
+    # = closed 10.1021/acs.jafc.6b02480
+    "masthead",
 
-        # no examples for these yet
-        "supplement",
-        "figure",
-        "faq"
-    ]
-    for bad_word in anchor_blacklist:
-        if bad_word in anchor_text.lower():
-            return True
+    # closed http://eprints.soton.ac.uk/342694/
+    "download statistics",
 
-    return False
+    # no examples for these yet
+    "supplement",
+    "figure",
+    "faq"
+]
+bad_anchor_matcher = MultiMatcher(ANCHOR_BLACKLIST, ignore_case=True)
+
+def has_bad_anchor_word(anchor_text):
+    return bad_anchor_matcher.matches(anchor_text)
 
 
 def get_pdf_in_meta(page):
-    if "citation_pdf_url" in page:
+    page = as_parsed_page(page)
+    if "citation_pdf_url" in page.html:
         if DEBUG_SCRAPING:
             logger.info(u"citation_pdf_url in page")
 
-        tree = get_tree(page)
+        tree = page.tree
         if tree is not None:
             metas = tree.xpath("//meta")
             for meta in metas:
@@ -841,14 +872,14 @@ def get_pdf_in_meta(page):
         else:
             # backup if tree fails
             regex = r'<meta name="citation_pdf_url" content="(.*?)">'
-            matches = re.findall(regex, page)
+            matches = re.findall(regex, page.html)
             if matches:
                 link = DuckLink(href=matches[0], anchor="<meta citation_pdf_url>")
                 return link
     return None
 
 def get_pdf_from_javascript(page):
-    matches = re.findall('"pdfUrl":"(.*?)"', page)
+    matches = re.findall('"pdfUrl":"(.*?)"', as_parsed_page(page).html)
     if matches:
         link = DuckLink(href=matches[0], anchor="pdfUrl")
         return link